@@ -0,0 +1,255 @@
+"""
+Micro-benchmarks for the functions that run on every refresh and monitor tick.
+
+    python benchmarks/bench_hot_paths.py                    # compare with the baselines
+    python benchmarks/bench_hot_paths.py --threshold 0.25   # gate timings too
+    python benchmarks/bench_hot_paths.py --save             # record new baselines
+
+Every case runs against fixture rosters of 50, 500 and 5000 admins, with the
+HTTP layer stubbed, and reports the median time per call and the peak memory
+allocated per call.
+
+Allocations are deterministic for a given Python version, so they are the
+gate: baseline.json (checked in, one entry per Python version) holds them,
+and the run fails when a case allocates more than --alloc-threshold above
+it, or when there is no baseline for this Python version.
+
+Timings depend on the machine. They are saved to timings.json (not checked
+in) and only compared when --threshold is given: a case regresses when its
+median is slower by more than the threshold plus NOISE_FACTOR times the
+spread (interquartile range) of both runs.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import timeit
+import tracemalloc
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bot  # noqa: E402
+
+ROSTER_SIZES = (50, 500, 5000)
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+TIMINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "timings.json")
+PYTHON_VERSION = "{}.{}".format(*sys.version_info)
+REPEAT = 21
+MIN_RUN_TIME = 0.05
+NOISE_FACTOR = 3
+
+
+# ===========================================================
+#                        FIXTURES
+# ===========================================================
+
+def make_roster(size: int, seed: int = 1) -> list[dict]:
+    rng = random.Random(seed)
+    roster = []
+    for i in range(size):
+        online = rng.randint(60, 6 * 3600) if rng.random() < 0.3 else 0
+        roster.append({
+            "login": f"Admin_{i:04d}",
+            "admin": rng.choice((1, 1, 1, 2, 2, 3, 4)),
+            "online": online,
+            "dayOnline": online + rng.randint(0, 4 * 3600),
+            "weekOnline": rng.randint(0, 40 * 3600),
+            "monthOnline": rng.randint(0, 160 * 3600),
+            "reports": {"default": rng.randint(0, 30), "moderation": rng.randint(0, 5)},
+            "otherAccountsOnline": {"weekOnline": 0, "monthOnline": 0},
+        })
+    return roster
+
+
+def churn(roster: list[dict], seed: int = 2) -> list[dict]:
+    """The next poll: some admins join or leave, some reports move"""
+    rng = random.Random(seed)
+    changed = []
+    for admin in roster:
+        admin = dict(admin, reports=dict(admin["reports"]))
+        if rng.random() < 0.05:
+            admin["online"] = 0 if admin["online"] else rng.randint(60, 600)
+        if rng.random() < 0.1:
+            admin["reports"]["default"] = max(0, admin["reports"]["default"] + rng.randint(-3, 3))
+        changed.append(admin)
+    return changed
+
+
+def make_servers() -> list[dict]:
+    rng = random.Random(3)
+    ids = [f"ru{i}" for i in range(1, 17)] + ["en1", "en2", "de1", "pl1"]
+    return [
+        {
+            "id": server_id,
+            "name": server_id.upper(),
+            "status": 1,
+            "techWorks": 0,
+            "players": rng.randint(100, 2000),
+            "queuedPlayers": rng.choice((0, 0, 0, rng.randint(1, 300))),
+        }
+        for server_id in ids
+    ]
+
+
+def make_data(roster: list[dict]) -> dict:
+    return {
+        "/admin/admins": {"status": True, "result": roster},
+        "/admin/reports/statistics": {"status": True, "result": {"moderation": 12, "progress": 40, "unresolved": 85}},
+        "/meta/servers": {"status": True, "result": {"servers": make_servers()}},
+    }
+
+
+# ===========================================================
+#                          CASES
+# ===========================================================
+
+def make_cases(size: int) -> dict:
+    roster = make_roster(size)
+    data = make_data(roster)
+    session = bot.UserSession("bench", "RU1", "bench", watchlist=[roster[0]["login"]])
+    live = lambda view_type, **kw: bot.LiveMessage(0, 0, view_type, **kw)
+    page_admins, page, total_pages = bot.page_slice(roster, 1, bot.ADMINS_PER_PAGE)
+
+    snapshots = [roster, churn(roster)]
+    stats = [data["/admin/reports/statistics"]["result"], {"moderation": 10, "progress": 41, "unresolved": 90}]
+    state = bot.MonitorState(
+        {a["login"] for a in roster if a["online"] > 0}, dict(stats[0]),
+        {a["login"]: bot.admin_report_count(a) for a in roster}
+    )
+    tick = [0]
+
+    def monitor_diff():
+        # Alternate between two polls so every call sees real changes
+        tick[0] ^= 1
+        return bot.monitor_diff(state, set(), snapshots[tick[0]], stats[tick[0]])
+
+    async def fake_api_get(session, endpoint):
+        return data[endpoint]
+
+    loop = asyncio.new_event_loop()
+    bot.api_get = fake_api_get
+
+    return {
+        "generate_online": lambda: bot.generate_online(session, live("online"), data),
+        "generate_reports": lambda: bot.generate_reports(session, live("reports"), data),
+        "generate_servers": lambda: bot.generate_servers(session, live("servers"), data),
+        "generate_admins": lambda: bot.generate_admins_with_buttons(session, live("admins", page=1), data),
+        "generate_admins_l3": lambda: bot.generate_admins_with_buttons(session, live("admins", level_filter=3), data),
+        "kb_admins_select": lambda: bot.kb_admins_select(page_admins, page, total_pages, 0, True),
+        "format_time": lambda: [bot.format_time(a["weekOnline"]) for a in roster],
+        "monitor_diff": monitor_diff,
+        "render_view_online": lambda: loop.run_until_complete(bot.render_view(session, live("online"))),
+    }
+
+
+def measure(func) -> dict:
+    timer = timeit.Timer(func)
+    loops, elapsed = timer.autorange()
+    if elapsed < MIN_RUN_TIME:
+        loops = max(loops, int(loops * MIN_RUN_TIME / max(elapsed, 1e-9)))
+    times = sorted(t / loops for t in timer.repeat(REPEAT, loops))
+    quartiles = statistics.quantiles(times, n=4)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    func()
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return {"time": statistics.median(times), "spread": quartiles[2] - quartiles[0], "alloc": peak}
+
+
+def run_all() -> dict:
+    results = {}
+    for size in ROSTER_SIZES:
+        for name, func in make_cases(size).items():
+            results[f"{name}/{size}"] = measure(func)
+    return results
+
+
+# ===========================================================
+#                          REPORT
+# ===========================================================
+
+def compare(
+    results: dict, allocs: dict, timings: dict, threshold: Optional[float], alloc_threshold: float
+) -> list[str]:
+    print(f"{'case':<28} {'time/call':>12} {'vs local':>9} {'alloc/call':>12} {'vs baseline':>12}")
+    regressions = []
+    for key, result in results.items():
+        line = f"{key:<28} {result['time'] * 1e6:>10.1f}us"
+        timing = timings.get(key)
+        if timing:
+            change = result["time"] / timing["time"] - 1
+            line += f" {change:>+9.0%}"
+            noise = NOISE_FACTOR * (result["spread"] + timing["spread"])
+            if threshold is not None and result["time"] > timing["time"] * (1 + threshold) + noise:
+                regressions.append(f"{key}: {change:+.0%} time")
+        else:
+            line += f" {'':>9}"
+        
+        line += f" {result['alloc'] / 1024:>10.1f}KB"
+        base = allocs.get(key)
+        if base is None:
+            regressions.append(f"{key}: no allocation baseline")
+        else:
+            line += f" {result['alloc'] - base:>+10d}B"
+            # Small absolute slack so tiny allocations do not flap
+            if result["alloc"] > base * (1 + alloc_threshold) + 1024:
+                regressions.append(f"{key}: {result['alloc'] - base:+d} bytes allocated")
+        print(line)
+    return regressions
+
+
+def load_json(path: str) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_json(path: str, data: dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--save", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--threshold", type=float, help="also fail on a slowdown beyond this plus noise (0.25 = 25%%)")
+    parser.add_argument("--alloc-threshold", type=float, default=0.25, help="allowed allocation growth")
+    args = parser.parse_args()
+
+    results = run_all()
+
+    baseline = load_json(BASELINE_PATH)
+    if args.save:
+        baseline[PYTHON_VERSION] = {key: result["alloc"] for key, result in results.items()}
+        save_json(BASELINE_PATH, baseline)
+        save_json(TIMINGS_PATH, {key: {"time": r["time"], "spread": r["spread"]} for key, r in results.items()})
+        compare(results, baseline[PYTHON_VERSION], {}, None, args.alloc_threshold)
+        print(f"\nBaselines saved to {BASELINE_PATH} (Python {PYTHON_VERSION}) and {TIMINGS_PATH}")
+        return
+
+    allocs = baseline.get(PYTHON_VERSION, {})
+    if not allocs:
+        print(f"No allocation baseline for Python {PYTHON_VERSION}, run with --save to record one\n")
+    timings = load_json(TIMINGS_PATH)
+    if args.threshold is not None and not timings:
+        print("No local timings, run with --save first to compare them\n")
+
+    regressions = compare(results, allocs, timings, args.threshold, args.alloc_threshold)
+    if regressions:
+        print("\nRegressions:\n" + "\n".join(f"  {r}" for r in regressions))
+        sys.exit(1)
+    print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,1236 +1,4133 @@
-﻿import asyncio
-from dataclasses import dataclass, field
-from datetime import datetime
-from typing import Optional
-import aiohttp
-from aiogram import Bot, Dispatcher, Router, F
-from aiogram.types import (
-    Message, CallbackQuery,
-    InlineKeyboardMarkup, InlineKeyboardButton,
-    BotCommand
-)
-from aiogram.filters import Command
-from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.exceptions import TelegramBadRequest
-
-# ===========================================================
-#                        CONFIGURATION
-# ===========================================================
-
-BOT_TOKEN = "8437034788:AAGo7r2mWueww-CMEtrVICqATt9YxLQnwnQ"
-BASE_URL = "https://admin.majestic-files.net/api"
-MONITOR_INTERVAL = 10
-AUTO_REFRESH_INTERVAL = 15
-ADMINS_PER_PAGE = 10
-
-# ===========================================================
-#                      INITIALIZATION
-# ===========================================================
-
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
-router = Router()
-
-
-# ===========================================================
-#                       DATA MODELS
-# ===========================================================
-
-@dataclass
-class UserSession:
-    session_id: str
-    server_id: str
-    login: str
-    admin_level: int = 0
-    rights: list = field(default_factory=list)
-    notifications: bool = True
-    auto_refresh: bool = True
-    tracked_admin: str = ""
-
-
-@dataclass
-class MonitorState:
-    online_admins: set = field(default_factory=set)
-    reports_stats: dict = field(default_factory=dict)
-    admin_reports: dict = field(default_factory=dict)
-
-
-@dataclass
-class LiveMessage:
-    chat_id: int
-    message_id: int
-    view_type: str
-    page: int = 0
-    level_filter: int = 0
-    admin_login: str = ""
-
-
-user_sessions: dict[int, UserSession] = {}
-monitor_states: dict[int, MonitorState] = {}
-monitor_tasks: dict[int, asyncio.Task] = {}
-live_messages: dict[int, LiveMessage] = {}
-refresh_tasks: dict[int, asyncio.Task] = {}
-
-
-class AuthStates(StatesGroup):
-    waiting_server = State()
-    waiting_login = State()
-    waiting_password = State()
-    waiting_2fa = State()
-
-
-# ===========================================================
-#                        UTILITIES
-# ===========================================================
-
-def format_time(seconds: int) -> str:
-    """Format time from seconds to human readable"""
-    if seconds == 0:
-        return "0m"
-    
-    minutes = seconds // 60
-    hours, mins = divmod(minutes, 60)
-    
-    if hours >= 24:
-        days, hours = divmod(hours, 24)
-        return f"{days}d {hours}h"
-    if hours > 0:
-        return f"{hours}h {mins}m" if mins else f"{hours}h"
-    return f"{mins}m"
-
-
-def get_level_emoji(level: int) -> str:
-    return {4: "[4]", 3: "[3]", 2: "[2]", 1: "[1]"}.get(level, "[?]")
-
-
-def get_level_name(level: int) -> str:
-    return f"Level {level}"
-
-
-def get_timestamp() -> str:
-    return datetime.now().strftime("%H:%M:%S")
-
-
-async def api_get(session: UserSession, endpoint: str) -> dict:
-    cookies = {"sessionId": session.session_id, "serverId": session.server_id}
-    async with aiohttp.ClientSession(cookies=cookies) as http:
-        async with http.get(f"{BASE_URL}{endpoint}") as resp:
-            return await resp.json()
-
-
-# ===========================================================
-#                        KEYBOARDS
-# ===========================================================
-
-def kb_servers():
-    buttons = []
-    for i in range(1, 17, 4):
-        row = [InlineKeyboardButton(text=f"RU{j}", callback_data=f"server:RU{j}") 
-               for j in range(i, min(i + 4, 17))]
-        buttons.append(row)
-    buttons.append([InlineKeyboardButton(text="Cancel", callback_data="cancel")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
-
-
-def kb_main():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="Summary", callback_data="view:summary"),
-            InlineKeyboardButton(text="Online", callback_data="view:online")
-        ],
-        [
-            InlineKeyboardButton(text="Reports", callback_data="view:reports"),
-            InlineKeyboardButton(text="Servers", callback_data="view:servers")
-        ],
-        [
-            InlineKeyboardButton(text="All Admins", callback_data="view:admins:0:0"),
-            InlineKeyboardButton(text="Settings", callback_data="settings")
-        ]
-    ])
-
-
-def kb_view(view_type: str, auto_refresh: bool = True):
-    refresh_icon = "||" if auto_refresh else ">"
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="Refresh", callback_data=f"refresh:{view_type}"),
-            InlineKeyboardButton(text=f"{refresh_icon} Auto", callback_data=f"toggle_auto:{view_type}"),
-        ],
-        [InlineKeyboardButton(text="< Menu", callback_data="menu")]
-    ])
-
-
-def kb_admins_select(admins: list, page: int, total_pages: int, level_filter: int, auto_refresh: bool):
-    buttons = []
-    
-    for i in range(0, len(admins), 2):
-        row = []
-        for admin in admins[i:i+2]:
-            is_online = "* " if admin.get("online", 0) > 0 else ""
-            row.append(InlineKeyboardButton(
-                text=f"{is_online}{admin['login'][:12]}",
-                callback_data=f"admin:{admin['login']}"
-            ))
-        buttons.append(row)
-    
-    level_row = []
-    for lvl in [0, 4, 3, 2, 1]:
-        text = "All" if lvl == 0 else f"L{lvl}"
-        if lvl == level_filter:
-            text = f"[{text}]"
-        level_row.append(InlineKeyboardButton(text=text, callback_data=f"filter:{lvl}:{page}"))
-    buttons.append(level_row)
-    
-    nav_row = []
-    if page > 0:
-        nav_row.append(InlineKeyboardButton(text="<", callback_data=f"page:{page-1}:{level_filter}"))
-    nav_row.append(InlineKeyboardButton(text=f"{page+1}/{total_pages}", callback_data="noop"))
-    if page < total_pages - 1:
-        nav_row.append(InlineKeyboardButton(text=">", callback_data=f"page:{page+1}:{level_filter}"))
-    buttons.append(nav_row)
-    
-    refresh_icon = "||" if auto_refresh else ">"
-    buttons.append([
-        InlineKeyboardButton(text="Refresh", callback_data=f"refresh:admins:{page}:{level_filter}"),
-        InlineKeyboardButton(text=f"{refresh_icon} Auto", callback_data=f"toggle_auto:admins"),
-    ])
-    buttons.append([InlineKeyboardButton(text="< Menu", callback_data="menu")])
-    
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
-
-
-def kb_admin_profile(admin_login: str, is_tracked: bool, auto_refresh: bool):
-    track_text = "Untrack" if is_tracked else "Track"
-    refresh_icon = "||" if auto_refresh else ">"
-    
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=track_text, callback_data=f"track:{admin_login}")],
-        [
-            InlineKeyboardButton(text="Refresh", callback_data=f"refresh:profile:{admin_login}"),
-            InlineKeyboardButton(text=f"{refresh_icon} Auto", callback_data=f"toggle_auto:profile:{admin_login}"),
-        ],
-        [InlineKeyboardButton(text="< Back", callback_data="view:admins:0:0")],
-        [InlineKeyboardButton(text="< Menu", callback_data="menu")]
-    ])
-
-
-def kb_settings(session: UserSession):
-    notif = "Notifications: ON" if session.notifications else "Notifications: OFF"
-    auto = "Auto-refresh: ON" if session.auto_refresh else "Auto-refresh: OFF"
-    
-    buttons = [
-        [InlineKeyboardButton(text=notif, callback_data="toggle_notif")],
-        [InlineKeyboardButton(text=auto, callback_data="toggle_global_auto")],
-    ]
-    
-    if session.tracked_admin:
-        buttons.append([InlineKeyboardButton(
-            text=f"Untrack {session.tracked_admin}", 
-            callback_data="untrack"
-        )])
-    
-    buttons.append([InlineKeyboardButton(text="Logout", callback_data="logout")])
-    buttons.append([InlineKeyboardButton(text="< Menu", callback_data="menu")])
-    
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
-
-
-def kb_guest():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Login", callback_data="login")]
-    ])
-
-
-# ===========================================================
-#                   CONTENT GENERATORS
-# ===========================================================
-
-async def generate_summary(session: UserSession) -> str:
-    stats = await api_get(session, "/admin/reports/statistics")
-    admins_data = await api_get(session, "/admin/admins")
-    servers_data = await api_get(session, "/meta/servers")
-    
-    r = stats.get("result", {})
-    admins = admins_data.get("result", [])
-    servers = servers_data.get("result", {}).get("servers", [])
-    
-    online_admins = [a for a in admins if a.get("online", 0) > 0]
-    total_reports = sum(
-        a.get("reports", {}).get("default", 0) + a.get("reports", {}).get("moderation", 0)
-        for a in admins
-    )
-    
-    ru_servers = [s for s in servers if s["id"].startswith("ru")]
-    total_players = sum(s.get("players", 0) for s in ru_servers)
-    
-    my_server = next((s for s in servers if s["id"].lower() == session.server_id.lower()), None)
-    my_server_info = ""
-    if my_server:
-        my_players = my_server.get("players", 0)
-        my_queue = my_server.get("queuedPlayers", 0)
-        my_status = "ON" if my_server.get("status") else "OFF"
-        queue_str = f" (+{my_queue})" if my_queue > 0 else ""
-        my_server_info = f"\nYour server ({my_server['name']}): {my_status} {my_players}{queue_str}"
-    
-    return (
-        f"<b>Summary</b>\n"
-        f"{'='*20}\n\n"
-        f"<b>Reports:</b>\n"
-        f"  Moderation: <b>{r.get('moderation', 0)}</b>\n"
-        f"  In progress: <b>{r.get('progress', 0)}</b>\n"
-        f"  Unresolved: <b>{r.get('unresolved', 0)}</b>\n"
-        f"  At admins: <b>{total_reports}</b>\n\n"
-        f"<b>Admins:</b> {len(online_admins)}/{len(admins)} online\n"
-        f"<b>Players:</b> {total_players}{my_server_info}\n\n"
-        f"<i>Updated: {get_timestamp()}</i>"
-    )
-
-
-async def generate_online(session: UserSession) -> str:
-    data = await api_get(session, "/admin/admins")
-    admins = data.get("result", [])
-    online = [a for a in admins if a.get("online", 0) > 0]
-    
-    by_level = {}
-    for admin in online:
-        lvl = admin.get("admin", 0)
-        by_level.setdefault(lvl, []).append(admin)
-    
-    text = (
-        f"<b>Admins Online</b>\n"
-        f"{'='*20}\n"
-        f"Online: <b>{len(online)}</b> / {len(admins)}\n\n"
-    )
-    
-    if online:
-        for lvl in sorted(by_level.keys(), reverse=True):
-            text += f"<b>{get_level_name(lvl)}</b>\n"
-            # Sort by dayOnline (today's online time)
-            for admin in sorted(by_level[lvl], key=lambda x: x.get("dayOnline", 0), reverse=True):
-                # dayOnline = online time today (in seconds)
-                time_str = format_time(admin.get("dayOnline", 0))
-                reports = admin.get("reports", {})
-                rep = reports.get("default", 0) + reports.get("moderation", 0)
-                rep_str = f" [R:{rep}]" if rep > 0 else ""
-                text += f"  * {admin['login']} <code>({time_str})</code>{rep_str}\n"
-            text += "\n"
-    else:
-        text += "No one online\n"
-    
-    text += f"<i>Updated: {get_timestamp()}</i>"
-    return text
-
-
-async def generate_reports(session: UserSession) -> str:
-    stats = await api_get(session, "/admin/reports/statistics")
-    admins_data = await api_get(session, "/admin/admins")
-    
-    r = stats.get("result", {})
-    admins = admins_data.get("result", [])
-    
-    admin_reports = []
-    for admin in admins:
-        rep = admin.get("reports", {})
-        count = rep.get("default", 0) + rep.get("moderation", 0)
-        if count > 0:
-            is_online = admin.get("online", 0) > 0
-            admin_reports.append((admin["login"], count, is_online, admin.get("admin", 0)))
-    
-    admin_reports.sort(key=lambda x: x[1], reverse=True)
-    total = sum(x[1] for x in admin_reports)
-    
-    text = (
-        f"<b>Reports</b>\n"
-        f"{'='*20}\n\n"
-        f"<b>Statistics:</b>\n"
-        f"  Moderation: <b>{r.get('moderation', 0)}</b>\n"
-        f"  In progress: <b>{r.get('progress', 0)}</b>\n"
-        f"  Unresolved: <b>{r.get('unresolved', 0)}</b>\n\n"
-    )
-    
-    if admin_reports:
-        text += f"<b>At admins</b> ({total}):\n"
-        for login, count, is_online, lvl in admin_reports[:12]:
-            status = "*" if is_online else " "
-            text += f"  {status} {get_level_emoji(lvl)} {login}: <b>{count}</b>\n"
-        if len(admin_reports) > 12:
-            text += f"  <i>... and {len(admin_reports) - 12} more</i>\n"
-    
-    text += f"\n<i>Updated: {get_timestamp()}</i>"
-    return text
-
-
-async def generate_servers(session: UserSession) -> str:
-    data = await api_get(session, "/meta/servers")
-    servers = data.get("result", {}).get("servers", [])
-    
-    ru_servers = sorted(
-        [s for s in servers if s["id"].startswith("ru")],
-        key=lambda x: int(x["id"][2:]) if x["id"][2:].isdigit() else 99
-    )
-    
-    total = sum(s.get("players", 0) for s in ru_servers)
-    queue = sum(s.get("queuedPlayers", 0) for s in ru_servers)
-    
-    text = (
-        f"<b>Servers</b>\n"
-        f"{'='*20}\n"
-        f"Total: <b>{total}</b>"
-    )
-    if queue > 0:
-        text += f" (+{queue} in queue)"
-    text += "\n\n"
-    
-    for s in ru_servers:
-        status = "+" if s.get("status") else "-"
-        tech = " [TECH]" if s.get("techWorks") else ""
-        players = s.get("players", 0)
-        q = s.get("queuedPlayers", 0)
-        q_str = f" <i>(+{q})</i>" if q > 0 else ""
-        text += f"{status} <b>{s['name']}</b>: {players}{q_str}{tech}\n"
-    
-    text += f"\n<i>Updated: {get_timestamp()}</i>"
-    return text
-
-
-async def generate_admins_with_buttons(session: UserSession, page: int = 0, level_filter: int = 0):
-    data = await api_get(session, "/admin/admins")
-    admins = data.get("result", [])
-    
-    if level_filter > 0:
-        admins = [a for a in admins if a.get("admin", 0) == level_filter]
-    
-    admins = sorted(admins, key=lambda x: x.get("weekOnline", 0), reverse=True)
-    
-    total_pages = max(1, (len(admins) + ADMINS_PER_PAGE - 1) // ADMINS_PER_PAGE)
-    page = min(page, total_pages - 1)
-    
-    start = page * ADMINS_PER_PAGE
-    end = start + ADMINS_PER_PAGE
-    page_admins = admins[start:end]
-    
-    filter_text = f"Level {level_filter}" if level_filter > 0 else "All levels"
-    
-    tracked_info = ""
-    if session.tracked_admin:
-        tracked = next((a for a in data.get("result", []) if a["login"] == session.tracked_admin), None)
-        if tracked:
-            is_on = "*" if tracked.get("online", 0) > 0 else " "
-            rep = tracked.get("reports", {}).get("default", 0) + tracked.get("reports", {}).get("moderation", 0)
-            tracked_info = f"\nTracking: {is_on} <b>{session.tracked_admin}</b> (R:{rep})\n"
-    
-    text = (
-        f"<b>Admins</b> ({len(admins)})\n"
-        f"{'='*20}\n"
-        f"Filter: <b>{filter_text}</b>{tracked_info}\n"
-        f"<i>Select admin for details:</i>\n\n"
-        f"<i>Updated: {get_timestamp()}</i>"
-    )
-    
-    kb = kb_admins_select(page_admins, page, total_pages, level_filter, session.auto_refresh)
-    return text, kb, total_pages
-
-
-async def generate_admin_profile(session: UserSession, admin_login: str) -> tuple[str, dict]:
-    data = await api_get(session, "/admin/admins")
-    admins = data.get("result", [])
-    
-    admin = next((a for a in admins if a["login"] == admin_login), None)
-    if not admin:
-        return f"Admin <b>{admin_login}</b> not found", {}
-    
-    is_online = "ONLINE" if admin.get("online", 0) > 0 else "OFFLINE"
-    
-    reports = admin.get("reports", {})
-    rep_default = reports.get("default", 0)
-    rep_mod = reports.get("moderation", 0)
-    rep_total = rep_default + rep_mod
-    
-    other = admin.get("otherAccountsOnline", {})
-    
-    text = (
-        f"<b>{admin['login']}</b>\n"
-        f"{'='*20}\n\n"
-        f"{get_level_name(admin.get('admin', 0))}\n"
-        f"Status: {is_online}"
-    )
-    
-    if admin.get("online", 0) > 0:
-        text += f" ({format_time(admin.get('online', 0))})"
-    
-    text += (
-        f"\n\n<b>Online time:</b>\n"
-        f"  Today: <b>{format_time(admin.get('dayOnline', 0))}</b>\n"
-        f"  Week: <b>{format_time(admin.get('weekOnline', 0))}</b>\n"
-        f"  Month: <b>{format_time(admin.get('monthOnline', 0))}</b>\n\n"
-        f"<b>Reports:</b> {rep_total}\n"
-        f"  Default: {rep_default}\n"
-        f"  Moderation: {rep_mod}\n"
-    )
-    
-    if any(other.values()):
-        text += (
-            f"\n<b>Other accounts:</b>\n"
-            f"  Week: {format_time(other.get('weekOnline', 0))}\n"
-            f"  Month: {format_time(other.get('monthOnline', 0))}\n"
-        )
-    
-    text += f"\n<i>Updated: {get_timestamp()}</i>"
-    return text, admin
-
-
-# ===========================================================
-#                    AUTO-REFRESH SYSTEM
-# ===========================================================
-
-async def auto_refresh_loop(user_id: int):
-    while user_id in user_sessions and user_id in live_messages:
-        session = user_sessions[user_id]
-        if not session.auto_refresh:
-            await asyncio.sleep(AUTO_REFRESH_INTERVAL)
-            continue
-        
-        live = live_messages.get(user_id)
-        if not live:
-            break
-            
-        try:
-            if live.view_type == "summary":
-                text = await generate_summary(session)
-                kb = kb_view("summary", session.auto_refresh)
-            elif live.view_type == "online":
-                text = await generate_online(session)
-                kb = kb_view("online", session.auto_refresh)
-            elif live.view_type == "reports":
-                text = await generate_reports(session)
-                kb = kb_view("reports", session.auto_refresh)
-            elif live.view_type == "servers":
-                text = await generate_servers(session)
-                kb = kb_view("servers", session.auto_refresh)
-            elif live.view_type == "admins":
-                text, kb, _ = await generate_admins_with_buttons(session, live.page, live.level_filter)
-            elif live.view_type == "admin_profile" and live.admin_login:
-                text, admin = await generate_admin_profile(session, live.admin_login)
-                is_tracked = session.tracked_admin == live.admin_login
-                kb = kb_admin_profile(live.admin_login, is_tracked, session.auto_refresh)
-            else:
-                break
-            
-            await bot.edit_message_text(
-                text=text,
-                chat_id=live.chat_id,
-                message_id=live.message_id,
-                parse_mode="HTML",
-                reply_markup=kb
-            )
-        except TelegramBadRequest as e:
-            if "message is not modified" not in str(e):
-                if user_id in live_messages:
-                    del live_messages[user_id]
-                break
-        except Exception:
-            pass
-        
-        await asyncio.sleep(AUTO_REFRESH_INTERVAL)
-
-
-def start_auto_refresh(user_id: int):
-    if user_id in refresh_tasks:
-        refresh_tasks[user_id].cancel()
-    refresh_tasks[user_id] = asyncio.create_task(auto_refresh_loop(user_id))
-
-
-def stop_auto_refresh(user_id: int):
-    if user_id in refresh_tasks:
-        refresh_tasks[user_id].cancel()
-        del refresh_tasks[user_id]
-    if user_id in live_messages:
-        del live_messages[user_id]
-
-
-# ===========================================================
-#                    MONITORING SYSTEM
-# ===========================================================
-
-async def monitor_loop(user_id: int):
-    while user_id in user_sessions:
-        session = user_sessions[user_id]
-        if not session.notifications:
-            await asyncio.sleep(MONITOR_INTERVAL)
-            continue
-            
-        try:
-            admins_data = await api_get(session, "/admin/admins")
-            stats_data = await api_get(session, "/admin/reports/statistics")
-            
-            if not admins_data.get("status") or not stats_data.get("status"):
-                await asyncio.sleep(MONITOR_INTERVAL)
-                continue
-            
-            admins = admins_data["result"]
-            stats = stats_data["result"]
-            
-            if user_id not in monitor_states:
-                monitor_states[user_id] = MonitorState()
-                monitor_states[user_id].online_admins = {a["login"] for a in admins if a.get("online", 0) > 0}
-                monitor_states[user_id].reports_stats = stats.copy()
-                monitor_states[user_id].admin_reports = {
-                    a["login"]: a.get("reports", {}).get("default", 0) + a.get("reports", {}).get("moderation", 0)
-                    for a in admins
-                }
-                await asyncio.sleep(MONITOR_INTERVAL)
-                continue
-            
-            state = monitor_states[user_id]
-            notifications = []
-            
-            current_online = {a["login"] for a in admins if a.get("online", 0) > 0}
-            joined = current_online - state.online_admins
-            left = state.online_admins - current_online
-            
-            for login in joined:
-                admin = next((a for a in admins if a["login"] == login), None)
-                if admin:
-                    lvl = admin.get("admin", 0)
-                    notifications.append(f"+ <b>{login}</b> joined ({get_level_name(lvl)})")
-            
-            for login in left:
-                notifications.append(f"- <b>{login}</b> left")
-            
-            state.online_admins = current_online
-            
-            if stats != state.reports_stats:
-                old, new = state.reports_stats, stats
-                changes = []
-                
-                for key, name in [("moderation", "Moderation"), ("progress", "In progress"), ("unresolved", "Unresolved")]:
-                    if new.get(key, 0) != old.get(key, 0):
-                        diff = new[key] - old.get(key, 0)
-                        sign = "+" if diff > 0 else ""
-                        changes.append(f"{name}: {old.get(key, 0)} -> {new[key]} ({sign}{diff})")
-                
-                if changes:
-                    notifications.append("<b>Stats changed:</b>\n" + "\n".join(f"  {c}" for c in changes))
-                
-                state.reports_stats = stats.copy()
-            
-            tracked = session.tracked_admin
-            for admin in admins:
-                login = admin["login"]
-                new_count = admin.get("reports", {}).get("default", 0) + admin.get("reports", {}).get("moderation", 0)
-                old_count = state.admin_reports.get(login, 0)
-                
-                if new_count != old_count:
-                    diff = new_count - old_count
-                    if tracked and login != tracked:
-                        state.admin_reports[login] = new_count
-                        continue
-                    
-                    if diff > 0:
-                        notifications.append(f"<b>{login}</b> +{diff} report (total: {new_count})")
-                    else:
-                        notifications.append(f"<b>{login}</b> closed {abs(diff)} (left: {new_count})")
-                
-                state.admin_reports[login] = new_count
-            
-            if tracked:
-                tracked_admin = next((a for a in admins if a["login"] == tracked), None)
-                if tracked_admin:
-                    is_online = tracked_admin.get("online", 0) > 0
-                    was_online = tracked in state.online_admins
-                    
-                    if is_online and not was_online:
-                        notifications.insert(0, f"<b>Tracked admin {tracked} joined!</b>")
-                    elif not is_online and was_online:
-                        notifications.insert(0, f"<b>Tracked admin {tracked} left!</b>")
-            
-            if notifications:
-                text = "<b>Notifications</b>\n\n" + "\n\n".join(notifications)
-                try:
-                    await bot.send_message(user_id, text, parse_mode="HTML")
-                except:
-                    pass
-                    
-        except:
-            pass
-        
-        await asyncio.sleep(MONITOR_INTERVAL)
-
-
-def start_monitor(user_id: int):
-    if user_id in monitor_tasks:
-        monitor_tasks[user_id].cancel()
-    monitor_tasks[user_id] = asyncio.create_task(monitor_loop(user_id))
-
-
-def stop_monitor(user_id: int):
-    if user_id in monitor_tasks:
-        monitor_tasks[user_id].cancel()
-        del monitor_tasks[user_id]
-    if user_id in monitor_states:
-        del monitor_states[user_id]
-
-
-# ===========================================================
-#                      BOT COMMANDS
-# ===========================================================
-
-@router.message(Command("start"))
-async def cmd_start(message: Message, state: FSMContext):
-    await state.clear()
-    user_id = message.from_user.id
-    stop_auto_refresh(user_id)
-    
-    if user_id in user_sessions:
-        session = user_sessions[user_id]
-        await message.answer(
-            f"<b>MAJESTIC MONITOR</b>\n\n"
-            f"Account: <b>{session.login}</b>\n"
-            f"Server: <code>{session.server_id}</code>\n"
-            f"{get_level_name(session.admin_level)}\n\n"
-            f"Select action:",
-            parse_mode="HTML",
-            reply_markup=kb_main()
-        )
-    else:
-        await message.answer(
-            f"<b>MAJESTIC MONITOR</b>\n\n"
-            f"Bot for monitoring admin panel\n"
-            f"majestic-files.net\n\n"
-            f"Features:\n"
-            f"  - Real-time notifications\n"
-            f"  - Auto-refresh statistics\n"
-            f"  - Admin list with pagination",
-            parse_mode="HTML",
-            reply_markup=kb_guest()
-        )
-
-
-@router.message(Command("menu"))
-async def cmd_menu(message: Message):
-    user_id = message.from_user.id
-    stop_auto_refresh(user_id)
-    
-    if user_id not in user_sessions:
-        return await message.answer("Please login first", reply_markup=kb_guest())
-    
-    session = user_sessions[user_id]
-    await message.answer(
-        f"<b>{session.login}</b> | {session.server_id}\n\nSelect action:",
-        parse_mode="HTML",
-        reply_markup=kb_main()
-    )
-
-
-# ===========================================================
-#                    CALLBACK HANDLERS
-# ===========================================================
-
-@router.callback_query(F.data == "login")
-async def cb_login(callback: CallbackQuery, state: FSMContext):
-    await callback.message.edit_text(
-        "<b>Authorization</b>\n\nSelect server:",
-        parse_mode="HTML",
-        reply_markup=kb_servers()
-    )
-    await state.set_state(AuthStates.waiting_server)
-
-
-@router.callback_query(F.data.startswith("server:"))
-async def cb_server(callback: CallbackQuery, state: FSMContext):
-    server_id = callback.data.split(":")[1]
-    await state.update_data(server_id=server_id)
-    await callback.message.edit_text(
-        f"<b>Authorization</b>\n\nServer: <code>{server_id}</code>\n\nEnter login:",
-        parse_mode="HTML"
-    )
-    await state.set_state(AuthStates.waiting_login)
-
-
-@router.callback_query(F.data == "cancel")
-async def cb_cancel(callback: CallbackQuery, state: FSMContext):
-    await state.clear()
-    await callback.message.edit_text("Cancelled", reply_markup=kb_guest())
-
-
-@router.callback_query(F.data == "menu")
-async def cb_menu(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    stop_auto_refresh(user_id)
-    
-    if user_id not in user_sessions:
-        return await callback.message.edit_text("Session expired", reply_markup=kb_guest())
-    
-    session = user_sessions[user_id]
-    await callback.message.edit_text(
-        f"<b>{session.login}</b> | {session.server_id}\n\nSelect action:",
-        parse_mode="HTML",
-        reply_markup=kb_main()
-    )
-
-
-@router.callback_query(F.data == "noop")
-async def cb_noop(callback: CallbackQuery):
-    await callback.answer()
-
-
-@router.callback_query(F.data == "settings")
-async def cb_settings(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    stop_auto_refresh(user_id)
-    
-    if user_id not in user_sessions:
-        return await callback.message.edit_text("Session expired", reply_markup=kb_guest())
-    
-    session = user_sessions[user_id]
-    tracked_info = f"\nTracking: <b>{session.tracked_admin}</b>" if session.tracked_admin else ""
-    
-    await callback.message.edit_text(
-        f"<b>Settings</b>\n\n"
-        f"Account: <b>{session.login}</b>\n"
-        f"Server: <code>{session.server_id}</code>\n"
-        f"{get_level_name(session.admin_level)}{tracked_info}",
-        parse_mode="HTML",
-        reply_markup=kb_settings(session)
-    )
-
-
-@router.callback_query(F.data == "untrack")
-async def cb_untrack(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    if user_id not in user_sessions:
-        return await callback.answer("Session expired")
-    
-    session = user_sessions[user_id]
-    old_tracked = session.tracked_admin
-    session.tracked_admin = ""
-    
-    await callback.answer(f"Untracked {old_tracked}")
-    
-    await callback.message.edit_text(
-        f"<b>Settings</b>\n\n"
-        f"Account: <b>{session.login}</b>\n"
-        f"Server: <code>{session.server_id}</code>\n"
-        f"{get_level_name(session.admin_level)}",
-        parse_mode="HTML",
-        reply_markup=kb_settings(session)
-    )
-
-
-@router.callback_query(F.data == "toggle_notif")
-async def cb_toggle_notif(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    if user_id not in user_sessions:
-        return await callback.answer("Session expired")
-    
-    session = user_sessions[user_id]
-    session.notifications = not session.notifications
-    
-    await callback.answer(f"Notifications {'ON' if session.notifications else 'OFF'}")
-    await callback.message.edit_reply_markup(reply_markup=kb_settings(session))
-
-
-@router.callback_query(F.data == "toggle_global_auto")
-async def cb_toggle_global_auto(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    if user_id not in user_sessions:
-        return await callback.answer("Session expired")
-    
-    session = user_sessions[user_id]
-    session.auto_refresh = not session.auto_refresh
-    
-    await callback.answer(f"Auto-refresh {'ON' if session.auto_refresh else 'OFF'}")
-    await callback.message.edit_reply_markup(reply_markup=kb_settings(session))
-
-
-@router.callback_query(F.data == "logout")
-async def cb_logout(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    stop_monitor(user_id)
-    stop_auto_refresh(user_id)
-    if user_id in user_sessions:
-        del user_sessions[user_id]
-    
-    await callback.message.edit_text("Logged out", reply_markup=kb_guest())
-
-
-# ===========================================================
-#                    VIEW HANDLERS
-# ===========================================================
-
-@router.callback_query(F.data.startswith("view:"))
-async def cb_view(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    if user_id not in user_sessions:
-        return await callback.message.edit_text("Session expired", reply_markup=kb_guest())
-    
-    session = user_sessions[user_id]
-    parts = callback.data.split(":")
-    view_type = parts[1]
-    
-    await callback.answer("Loading...")
-    
-    try:
-        if view_type == "summary":
-            text = await generate_summary(session)
-            kb = kb_view("summary", session.auto_refresh)
-            live_messages[user_id] = LiveMessage(callback.message.chat.id, callback.message.message_id, "summary")
-            
-        elif view_type == "online":
-            text = await generate_online(session)
-            kb = kb_view("online", session.auto_refresh)
-            live_messages[user_id] = LiveMessage(callback.message.chat.id, callback.message.message_id, "online")
-            
-        elif view_type == "reports":
-            text = await generate_reports(session)
-            kb = kb_view("reports", session.auto_refresh)
-            live_messages[user_id] = LiveMessage(callback.message.chat.id, callback.message.message_id, "reports")
-            
-        elif view_type == "servers":
-            text = await generate_servers(session)
-            kb = kb_view("servers", session.auto_refresh)
-            live_messages[user_id] = LiveMessage(callback.message.chat.id, callback.message.message_id, "servers")
-            
-        elif view_type == "admins":
-            page = int(parts[2]) if len(parts) > 2 else 0
-            level_filter = int(parts[3]) if len(parts) > 3 else 0
-            text, kb, _ = await generate_admins_with_buttons(session, page, level_filter)
-            live_messages[user_id] = LiveMessage(
-                callback.message.chat.id, callback.message.message_id, "admins", page, level_filter
-            )
-        else:
-            return
-        
-        await callback.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
-        start_auto_refresh(user_id)
-        
-    except Exception as e:
-        await callback.answer(f"Error: {e}", show_alert=True)
-
-
-@router.callback_query(F.data.startswith("admin:"))
-async def cb_admin_profile(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    if user_id not in user_sessions:
-        return await callback.answer("Session expired")
-    
-    session = user_sessions[user_id]
-    admin_login = callback.data.split(":", 1)[1]
-    
-    await callback.answer("Loading...")
-    
-    try:
-        text, admin = await generate_admin_profile(session, admin_login)
-        is_tracked = session.tracked_admin == admin_login
-        kb = kb_admin_profile(admin_login, is_tracked, session.auto_refresh)
-        
-        live_messages[user_id] = LiveMessage(
-            callback.message.chat.id, callback.message.message_id, "admin_profile", 
-            admin_login=admin_login
-        )
-        
-        await callback.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
-        start_auto_refresh(user_id)
-        
-    except Exception as e:
-        await callback.answer(f"Error: {e}", show_alert=True)
-
-
-@router.callback_query(F.data.startswith("track:"))
-async def cb_track_admin(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    if user_id not in user_sessions:
-        return await callback.answer("Session expired")
-    
-    session = user_sessions[user_id]
-    admin_login = callback.data.split(":", 1)[1]
-    
-    if session.tracked_admin == admin_login:
-        session.tracked_admin = ""
-        await callback.answer(f"Untracked {admin_login}")
-    else:
-        session.tracked_admin = admin_login
-        await callback.answer(f"Now tracking {admin_login}")
-    
-    is_tracked = session.tracked_admin == admin_login
-    kb = kb_admin_profile(admin_login, is_tracked, session.auto_refresh)
-    await callback.message.edit_reply_markup(reply_markup=kb)
-
-
-@router.callback_query(F.data.startswith("refresh:"))
-async def cb_refresh(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    if user_id not in user_sessions:
-        return await callback.answer("Session expired")
-    
-    session = user_sessions[user_id]
-    parts = callback.data.split(":")
-    view_type = parts[1]
-    
-    try:
-        if view_type == "admins":
-            page = int(parts[2]) if len(parts) > 2 else 0
-            level_filter = int(parts[3]) if len(parts) > 3 else 0
-            text, kb, _ = await generate_admins_with_buttons(session, page, level_filter)
-            live_messages[user_id] = LiveMessage(
-                callback.message.chat.id, callback.message.message_id, "admins", page, level_filter
-            )
-        elif view_type == "profile":
-            admin_login = parts[2] if len(parts) > 2 else ""
-            text, _ = await generate_admin_profile(session, admin_login)
-            is_tracked = session.tracked_admin == admin_login
-            kb = kb_admin_profile(admin_login, is_tracked, session.auto_refresh)
-            live_messages[user_id] = LiveMessage(
-                callback.message.chat.id, callback.message.message_id, "admin_profile", admin_login=admin_login
-            )
-        else:
-            if view_type == "summary":
-                text = await generate_summary(session)
-            elif view_type == "online":
-                text = await generate_online(session)
-            elif view_type == "reports":
-                text = await generate_reports(session)
-            elif view_type == "servers":
-                text = await generate_servers(session)
-            else:
-                return await callback.answer()
-            kb = kb_view(view_type, session.auto_refresh)
-            live_messages[user_id] = LiveMessage(callback.message.chat.id, callback.message.message_id, view_type)
-        
-        await callback.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
-        await callback.answer("Refreshed")
-        
-    except TelegramBadRequest as e:
-        if "message is not modified" in str(e):
-            await callback.answer("No changes")
-        else:
-            await callback.answer("Error")
-    except Exception as e:
-        await callback.answer(f"Error: {e}", show_alert=True)
-
-
-@router.callback_query(F.data.startswith("toggle_auto:"))
-async def cb_toggle_auto(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    if user_id not in user_sessions:
-        return await callback.answer("Session expired")
-    
-    session = user_sessions[user_id]
-    session.auto_refresh = not session.auto_refresh
-    
-    parts = callback.data.split(":")
-    view_type = parts[1]
-    
-    if session.auto_refresh:
-        start_auto_refresh(user_id)
-        await callback.answer("Auto-refresh ON")
-    else:
-        stop_auto_refresh(user_id)
-        await callback.answer("Auto-refresh OFF")
-    
-    live = live_messages.get(user_id)
-    
-    if view_type == "admins" and live:
-        text, kb, _ = await generate_admins_with_buttons(session, live.page, live.level_filter)
-    elif view_type == "profile" and len(parts) > 2:
-        admin_login = parts[2]
-        is_tracked = session.tracked_admin == admin_login
-        kb = kb_admin_profile(admin_login, is_tracked, session.auto_refresh)
-    else:
-        kb = kb_view(view_type, session.auto_refresh)
-    
-    try:
-        await callback.message.edit_reply_markup(reply_markup=kb)
-    except:
-        pass
-
-
-@router.callback_query(F.data.startswith("page:"))
-async def cb_page(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    if user_id not in user_sessions:
-        return await callback.answer("Session expired")
-    
-    session = user_sessions[user_id]
-    parts = callback.data.split(":")
-    page = int(parts[1])
-    level_filter = int(parts[2])
-    
-    try:
-        text, kb, _ = await generate_admins_with_buttons(session, page, level_filter)
-        
-        live_messages[user_id] = LiveMessage(
-            callback.message.chat.id, callback.message.message_id, "admins", page, level_filter
-        )
-        
-        await callback.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
-        await callback.answer()
-        
-    except Exception as e:
-        await callback.answer(f"Error: {e}", show_alert=True)
-
-
-@router.callback_query(F.data.startswith("filter:"))
-async def cb_filter(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    if user_id not in user_sessions:
-        return await callback.answer("Session expired")
-    
-    session = user_sessions[user_id]
-    parts = callback.data.split(":")
-    level_filter = int(parts[1])
-    
-    try:
-        text, kb, _ = await generate_admins_with_buttons(session, 0, level_filter)
-        
-        live_messages[user_id] = LiveMessage(
-            callback.message.chat.id, callback.message.message_id, "admins", 0, level_filter
-        )
-        
-        await callback.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
-        await callback.answer()
-        
-    except Exception as e:
-        await callback.answer(f"Error: {e}", show_alert=True)
-
-
-# ===========================================================
-#                    AUTHORIZATION
-# ===========================================================
-
-@router.message(AuthStates.waiting_login)
-async def process_login(message: Message, state: FSMContext):
-    await state.update_data(login=message.text)
-    await message.answer("Enter password:")
-    await state.set_state(AuthStates.waiting_password)
-
-
-@router.message(AuthStates.waiting_password)
-async def process_password(message: Message, state: FSMContext):
-    await state.update_data(password=message.text)
-    try:
-        await message.delete()
-    except:
-        pass
-    await message.answer("Enter 2FA code:")
-    await state.set_state(AuthStates.waiting_2fa)
-
-
-@router.message(AuthStates.waiting_2fa)
-async def process_2fa(message: Message, state: FSMContext):
-    data = await state.get_data()
-    await state.clear()
-    
-    status_msg = await message.answer("Authorizing...")
-    
-    auth_data = {
-        "login": data["login"],
-        "password": data["password"],
-        "serverId": data["server_id"],
-        "code": message.text
-    }
-    
-    async with aiohttp.ClientSession() as http_session:
-        try:
-            async with http_session.post(f"{BASE_URL}/auth/login", json=auth_data) as resp:
-                login_resp = await resp.json()
-            
-            if login_resp.get("status") and login_resp.get("result", {}).get("sessionId"):
-                result = login_resp["result"]
-                session_id = result["sessionId"]
-                server_id = result["serverId"]
-                
-                cookies = {"sessionId": session_id, "serverId": server_id}
-                async with http_session.get(f"{BASE_URL}/admin/users/me", cookies=cookies) as me_resp:
-                    me_data = await me_resp.json()
-                
-                user_info = me_data.get("result", {})
-                
-                user_sessions[message.from_user.id] = UserSession(
-                    session_id=session_id,
-                    server_id=server_id,
-                    login=result["account"]["login"],
-                    admin_level=user_info.get("adminLevel", 0),
-                    rights=user_info.get("rights", [])
-                )
-                
-                start_monitor(message.from_user.id)
-                
-                await status_msg.edit_text(
-                    f"<b>Authorization successful!</b>\n\n"
-                    f"Account: <b>{result['account']['login']}</b>\n"
-                    f"Server: <code>{server_id}</code>\n"
-                    f"{get_level_name(user_info.get('adminLevel', 0))}\n"
-                    f"Rights: {len(user_info.get('rights', []))}\n\n"
-                    f"Notifications: ON\n"
-                    f"Auto-refresh: ON",
-                    parse_mode="HTML",
-                    reply_markup=kb_main()
-                )
-            else:
-                error = login_resp.get("result", "Unknown error")
-                await status_msg.edit_text(
-                    f"<b>Authorization failed</b>\n\n{error}",
-                    parse_mode="HTML",
-                    reply_markup=kb_guest()
-                )
-        except Exception as e:
-            await status_msg.edit_text(
-                f"<b>Error</b>\n\n{e}",
-                parse_mode="HTML",
-                reply_markup=kb_guest()
-            )
-
-
-# ===========================================================
-#                         STARTUP
-# ===========================================================
-
-async def set_commands():
-    commands = [
-        BotCommand(command="start", description="Main menu"),
-        BotCommand(command="menu", description="Open menu"),
-    ]
-    await bot.set_my_commands(commands)
-
-
-async def shutdown():
-    print("\nShutting down...")
-    
-    for user_id in list(monitor_tasks.keys()):
-        stop_monitor(user_id)
-    print("  - Monitoring stopped")
-    
-    for user_id in list(refresh_tasks.keys()):
-        stop_auto_refresh(user_id)
-    print("  - Auto-refresh stopped")
-    
-    await bot.session.close()
-    print("  - Bot session closed")
-    
-    print("Bot stopped!")
-
-
-async def main():
-    await set_commands()
-    dp.include_router(router)
-    
-    print("=" * 30)
-    print("  MAJESTIC MONITOR")
-    print("=" * 30)
-    print("Bot started!")
-    print("Press Ctrl+C to stop\n")
-    
-    try:
-        await dp.start_polling(bot)
-    finally:
-        await shutdown()
-
-
-if __name__ == "__main__":
-    try:
-        asyncio.run(main())
-    except KeyboardInterrupt:
-        pass
+﻿import asyncio
+import hmac
+import html
+import inspect
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+import aiohttp
+from aiohttp import web
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import (
+    Message, CallbackQuery,
+    InlineKeyboardMarkup, InlineKeyboardButton,
+    BotCommand, Update
+)
+from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.exceptions import TelegramBadRequest
+
+# ===========================================================
+#                        CONFIGURATION
+# ===========================================================
+
+BOT_TOKEN = "8437034788:AAGo7r2mWueww-CMEtrVICqATt9YxLQnwnQ"
+BASE_URL = "https://admin.majestic-files.net/api"
+OWNER_IDS: set[int] = set()
+MONITOR_INTERVAL = 10
+# Live views and dashboards re-render from each new server snapshot, editing
+# one chat at most once per MIN_EDIT_SPACING seconds
+MIN_EDIT_SPACING = 3
+ADMINS_PER_PAGE = 10
+ONLINE_PER_PAGE = 40
+REPORTS_PER_PAGE = 25
+# Raw HTML length budget per message (Telegram's limit is 4096 visible chars)
+TEXT_BUDGET = 3900
+
+# Sharded mode: SHARD_COUNT > 1 runs one gateway process that polls Telegram
+# and routes updates by user_id to SHARD_COUNT worker processes.
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", 1))
+SHARD_DB_PATH = "shards.sqlite3"
+SERVER_LEASE_TTL = MONITOR_INTERVAL * 3
+SHARED_SNAPSHOT_POLL = 2
+
+# Sessions are persisted here (one file per shard) and restored on startup
+SESSIONS_PATH = "sessions.json"
+
+# Read-only HTTP API for internal tools: cached snapshots as JSON and a
+# Server-Sent Events stream of changes. Served on API_HOST:API_PORT (the
+# Procfile web process binds 0.0.0.0:$PORT). Requests need API_TOKEN, sent as
+# "Authorization: Bearer <token>"; without it the port is bound but every
+# request is refused.
+API_HOST = os.environ.get("API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("API_PORT", 0))
+API_TOKEN = os.environ.get("API_TOKEN", "")
+EVENT_STREAM_BUFFER = 1000
+SSE_KEEPALIVE = 15
+
+# Change events, alerts and delivery outcomes are appended to this JSONL log
+# (one file per shard), written in batches every LOG_FLUSH_INTERVAL seconds.
+# A log over LOG_MAX_BYTES is rotated to ".1".
+NOTIFICATION_LOG_PATH = "notifications.jsonl"
+LOG_FLUSH_INTERVAL = 2
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_PAGE = 20
+
+# Online intervals per admin (derived from snapshots) are kept this long
+TIMELINE_RETENTION = 7 * 24 * 3600
+
+# Growth rules ("unresolved +10 5m") can look back at most this far
+MAX_RULE_WINDOW = 3600
+
+# Report queue rates are averaged over this window (seconds)
+RATE_WINDOW = 600
+# Alert when unresolved grows by this much within RATE_WINDOW
+BACKLOG_GROWTH_ALERT = 20
+
+# /meta/servers is the same for everyone: one global poller fetches it,
+# serves it to views and alerts subscribers on status / tech works flips and
+# when a queue crosses QUEUE_ALERT_THRESHOLD. Drain rate is smoothed with
+# weight DRAIN_SMOOTHING per poll.
+SERVERS_POLL_INTERVAL = 30
+QUEUE_ALERT_THRESHOLD = 100
+DRAIN_SMOOTHING = 0.3
+
+# Daily digest is sent at this local time (HH:MM) and covers the 24 hours
+# before it, listing at most DIGEST_TOP_ADMINS admins by reports handled
+DIGEST_TIME = "23:55"
+DIGEST_TOP_ADMINS = 10
+
+# Idle users: stop live view refreshes, then detach monitoring (seconds)
+LIVE_IDLE_TIMEOUT = 30 * 60
+MONITOR_IDLE_TIMEOUT = 2 * 24 * 3600
+HIBERNATION_CHECK_INTERVAL = 60
+
+# Upstream budget per host: concurrent requests, requests per second, and how
+# long / how many background requests may queue before they are shed
+MAX_UPSTREAM_CONCURRENCY = 8
+MAX_UPSTREAM_QPS = 20
+BACKGROUND_MAX_WAIT = 30
+MAX_BACKGROUND_QUEUE = 200
+
+# Updates are handled concurrently across users (in order per user), with
+# at most this many handlers in flight
+MAX_INFLIGHT_UPDATES = 100
+# Per-user queue depth samples kept for /health
+UPDATE_DEPTH_SAMPLES = 1000
+
+# Request priority classes, lower is served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_MONITOR = 1
+PRIORITY_PREFETCH = 2
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_MONITOR, PRIORITY_PREFETCH)
+
+# After the admins list is shown, its likely next views (top profiles,
+# adjacent pages, other level filters) are pre-rendered in the background,
+# at most PREFETCH_BUDGET per user. A click within PREFETCH_TTL seconds of
+# the data being fetched is answered from memory.
+PREFETCH_BUDGET = 8
+PREFETCH_TOP_PROFILES = 4
+PREFETCH_TTL = 20
+
+# Latency samples kept per server and metric for /latency percentiles
+LATENCY_SAMPLES = 500
+
+# Deadlines (seconds) for one upstream response, and for fetching everything
+# a view needs. A view past its deadline is rendered from the last cached
+# responses and marked stale.
+ENDPOINT_DEADLINES = {"/admin/admins": 8, "/admin/reports/statistics": 5, "/meta/servers": 5}
+DEFAULT_DEADLINE = 8
+VIEW_DEADLINE = 10
+
+# Interactive requests still running after the endpoint's p95 latency get a
+# second attempt, and whichever answers first wins
+HEDGE_REQUESTS = True
+HEDGE_MIN_DELAY = 0.3
+HEDGE_MIN_SAMPLES = 20
+
+# /memory keeps this many past reports for growth, and shows this many
+# allocation sites from the tracemalloc diff
+MEMORY_HISTORY = 20
+MEMORY_TOP_SITES = 10
+
+# Supervisor: crashed long-lived tasks are restarted with exponential backoff,
+# and a task that has not ticked for STUCK_INTERVALS intervals is restarted too
+SUPERVISOR_INTERVAL = 5
+STUCK_INTERVALS = 5
+RESTART_BACKOFF_BASE = 1
+RESTART_BACKOFF_MAX = 300
+
+# Event loop lag is probed every LAG_PROBE_INTERVAL seconds, owners are
+# alerted when it exceeds LOOP_LAG_ALERT (seconds)
+LAG_PROBE_INTERVAL = 1
+LOOP_LAG_ALERT = 0.5
+LAG_SAMPLES = 600
+
+# Overload governor: every GOVERNOR_INTERVAL it compares upstream p95
+# latency and error rate (over GOVERNOR_WINDOW), event loop lag and the
+# upstream queue against their targets, stepping one level up under
+# pressure and one level down after GOVERNOR_RECOVERY calm checks.
+GOVERNOR_INTERVAL = 10
+GOVERNOR_WINDOW = 60
+GOVERNOR_RECOVERY = 3
+GOVERNOR_P95 = 3.0
+GOVERNOR_ERROR_RATE = 0.2
+GOVERNOR_LAG = LOOP_LAG_ALERT
+GOVERNOR_QUEUE = MAX_BACKGROUND_QUEUE // 2
+# Per level: refresh / poll interval multiplier, whether auto-refresh pauses
+# for views idle longer than IDLE_VIEW_PAUSE, notification coalescing seconds
+DEGRADATION_LEVELS = ((1, False, 0), (2, False, 0), (3, True, 30), (4, True, 60))
+IDLE_VIEW_PAUSE = 120
+UPSTREAM_OUTCOMES = 5000
+
+# ===========================================================
+#                      INITIALIZATION
+# ===========================================================
+
+bot = Bot(token=BOT_TOKEN)
+dp = Dispatcher(storage=MemoryStorage())
+router = Router()
+
+
+# ===========================================================
+#                       DATA MODELS
+# ===========================================================
+
+@dataclass
+class UserSession:
+    session_id: str
+    server_id: str
+    login: str
+    admin_level: int = 0
+    rights: list = field(default_factory=list)
+    notifications: bool = True
+    auto_refresh: bool = True
+    watchlist: list = field(default_factory=list)
+    rules: list = field(default_factory=list)
+    digest: bool = False
+    status_alerts: list = field(default_factory=list)
+
+
+@dataclass
+class AlertRule:
+    metric: str
+    subject: str = ""
+    op: str = ">"
+    threshold: int = 0
+    window: int = 0
+    active: bool = False
+
+
+@dataclass
+class MonitorState:
+    online_admins: set = field(default_factory=set)
+    reports_stats: dict = field(default_factory=dict)
+    admin_reports: dict = field(default_factory=dict)
+
+
+@dataclass
+class LiveMessage:
+    chat_id: int
+    message_id: int
+    view_type: str
+    page: int = 0
+    level_filter: int = 0
+    admin_login: str = ""
+
+
+@dataclass
+class SlidingWindow:
+    """Running sum of timestamped amounts over the last `span` seconds"""
+    span: float
+    events: deque = field(default_factory=deque)
+    total: int = 0
+    
+    def add(self, now: float, amount: int):
+        self.events.append((now, amount))
+        self.total += amount
+        self.expire(now)
+    
+    def expire(self, now: float):
+        while self.events and self.events[0][0] <= now - self.span:
+            self.total -= self.events.popleft()[1]
+
+
+@dataclass
+class QueueRates:
+    started: float
+    new_reports: SlidingWindow = field(default_factory=lambda: SlidingWindow(RATE_WINDOW))
+    closed: SlidingWindow = field(default_factory=lambda: SlidingWindow(RATE_WINDOW))
+    backlog: SlidingWindow = field(default_factory=lambda: SlidingWindow(RATE_WINDOW))
+    admin_closed: dict = field(default_factory=dict)
+    unresolved_dropped_at: float = 0.0
+    backlog_alert: bool = False
+    
+    def per_minute(self, window: SlidingWindow, now: float) -> float:
+        window.expire(now)
+        covered = min(window.span, now - self.started)
+        return window.total * 60 / covered if covered > 0 else 0.0
+
+
+class UpstreamBusy(Exception):
+    """Background request shed because the upstream budget is exhausted"""
+
+
+@dataclass
+class UpstreamBudget:
+    """
+    Concurrency and QPS limit for one upstream host. Waiters are served by
+    priority class, and round-robin across keys (sessions) within a class.
+    """
+    max_concurrency: int
+    qps: float
+    in_flight: int = 0
+    tokens: float = 0.0
+    refilled_at: float = 0.0
+    waiters: dict = field(default_factory=lambda: {p: OrderedDict() for p in PRIORITIES})
+    wakeup: Optional[asyncio.TimerHandle] = None
+    
+    def queued(self, priorities=PRIORITIES) -> int:
+        return sum(len(q) for p in priorities for q in self.waiters[p].values())
+    
+    async def acquire(self, priority: int, key: str):
+        background = priority != PRIORITY_INTERACTIVE
+        if background and self.queued(PRIORITIES[1:]) >= MAX_BACKGROUND_QUEUE:
+            raise UpstreamBusy("upstream queue is full")
+        
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[priority].setdefault(key, deque()).append(waiter)
+        self.dispatch()
+        
+        try:
+            async with asyncio.timeout(BACKGROUND_MAX_WAIT if background else None):
+                await waiter
+        except (TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+                self.discard(priority, key, waiter)
+            if isinstance(e, TimeoutError):
+                raise UpstreamBusy("upstream budget wait timed out") from None
+            raise
+    
+    def release(self):
+        self.in_flight -= 1
+        self.dispatch()
+    
+    def discard(self, priority: int, key: str, waiter: asyncio.Future):
+        queue = self.waiters[priority].get(key)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self.waiters[priority][key]
+    
+    def next_waiter(self) -> Optional[asyncio.Future]:
+        for priority in PRIORITIES:
+            by_key = self.waiters[priority]
+            while by_key:
+                key, queue = next(iter(by_key.items()))
+                waiter = queue.popleft()
+                if queue:
+                    by_key.move_to_end(key)
+                else:
+                    del by_key[key]
+                if not waiter.done():
+                    return waiter
+        return None
+    
+    def dispatch(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self.tokens = min(self.qps, self.tokens + (now - self.refilled_at) * self.qps)
+        self.refilled_at = now
+        
+        while self.in_flight < self.max_concurrency and self.tokens >= 1:
+            waiter = self.next_waiter()
+            if waiter is None:
+                return
+            self.in_flight += 1
+            self.tokens -= 1
+            waiter.set_result(None)
+        
+        if self.tokens < 1 and self.in_flight < self.max_concurrency and self.queued():
+            if self.wakeup is None or self.wakeup.when() <= now:
+                self.wakeup = loop.call_later((1 - self.tokens) / self.qps, self.dispatch)
+
+
+@dataclass
+class ServerStatus:
+    name: str
+    online: bool
+    tech_works: bool
+    queue: int
+    updated: float
+    queue_alert: bool = False
+    drain_rate: float = 0.0
+
+
+@dataclass
+class DailyDigest:
+    """Per-server aggregates since the last digest, updated on every snapshot"""
+    started: float
+    peak_online: int = 0
+    peak_at: float = 0.0
+    handled: dict = field(default_factory=dict)
+    closed: int = 0
+    new_reports: int = 0
+    backlog_sum: int = 0
+    backlog_max: int = 0
+    samples: int = 0
+
+
+@dataclass
+class AdminTimeline:
+    """
+    Closed online intervals of one admin, sorted and non-overlapping, so
+    both lists are ordered and every query is a bisect. `online_since` is
+    the start of the current session, 0 while offline.
+    """
+    starts: list = field(default_factory=list)
+    ends: list = field(default_factory=list)
+    online_since: float = 0.0
+    
+    def open(self, start: float):
+        if not self.online_since:
+            self.online_since = max(start, self.ends[-1] if self.ends else 0.0)
+    
+    def close(self, end: float):
+        self.starts.append(self.online_since)
+        self.ends.append(end)
+        self.online_since = 0.0
+        
+        expired = bisect_right(self.ends, end - TIMELINE_RETENTION)
+        if expired:
+            del self.starts[:expired]
+            del self.ends[:expired]
+    
+    def online_at(self, moment: float) -> bool:
+        if self.online_since and self.online_since <= moment:
+            return True
+        i = bisect_right(self.starts, moment) - 1
+        return i >= 0 and self.ends[i] > moment
+    
+    def sessions(self, start: float, end: float) -> list[tuple[float, float]]:
+        """Intervals overlapping [start, end), the current one ending at 0"""
+        first = bisect_right(self.ends, start)
+        last = bisect_left(self.starts, end)
+        found = list(zip(self.starts[first:last], self.ends[first:last]))
+        if self.online_since and self.online_since < end:
+            found.append((self.online_since, 0.0))
+        return found
+
+
+@dataclass
+class LogIndex:
+    """
+    Offset and time of every log record, and record numbers per server and
+    admin. Numbers restart in each file; `first` is the number of the file's
+    first record since startup, so cursors stay valid across rotation.
+    """
+    first: int = 0
+    size: int = 0
+    offsets: list = field(default_factory=list)
+    times: list = field(default_factory=list)
+    by_server: dict = field(default_factory=dict)
+    by_login: dict = field(default_factory=dict)
+    sent: int = 0
+    failed: int = 0
+    
+    def add(self, record: dict, offset: int):
+        number = len(self.offsets)
+        self.offsets.append(offset)
+        self.times.append(record["at"])
+        
+        if record["type"] == "delivery":
+            if record["ok"]:
+                self.sent += 1
+            else:
+                self.failed += 1
+            return
+        
+        server_id = record["server_id"].lower()
+        self.by_server.setdefault(server_id, []).append(number)
+        if record.get("login"):
+            self.by_login.setdefault((server_id, record["login"].lower()), []).append(number)
+
+
+@dataclass
+class Dashboard:
+    chat_id: int
+    message_id: int
+    view_type: str
+    owner_id: int
+
+
+@dataclass
+class ServerSnapshot:
+    server_id: str
+    admins: list
+    stats: dict
+    fetched_at: float
+    fetch_started: float = 0.0
+
+
+@dataclass
+class SupervisedTask:
+    """A long-lived task, how to restart it and how often it should tick"""
+    name: str
+    task: asyncio.Task
+    restart: Callable[[], None]
+    interval: float = 0.0
+    started: float = 0.0
+    last_tick: float = 0.0
+    failures: int = 0
+    restart_at: float = 0.0
+    error: str = ""
+
+
+user_sessions: dict[int, UserSession] = {}
+monitor_states: dict[int, MonitorState] = {}
+monitor_tasks: dict[int, asyncio.Task] = {}
+live_messages: dict[int, LiveMessage] = {}
+refresh_tasks: dict[int, asyncio.Task] = {}
+dashboards: dict[tuple[int, str], Dashboard] = {}
+dashboard_tasks: dict[tuple[int, str], asyncio.Task] = {}
+server_snapshots: dict[str, ServerSnapshot] = {}
+server_pollers: dict[str, asyncio.Task] = {}
+snapshot_conditions: dict[str, asyncio.Condition] = {}
+view_jobs: dict[tuple[int, int], asyncio.Task] = {}
+rule_index: dict[str, dict[tuple[str, str], list[tuple[int, AlertRule]]]] = {}
+server_metrics: dict[str, dict[tuple[str, str], int]] = {}
+metric_history: dict[str, dict[tuple[str, str], deque]] = {}
+pending_alerts: dict[int, list[str]] = {}
+queue_rates: dict[str, QueueRates] = {}
+daily_digests: dict[str, DailyDigest] = {}
+server_statuses: dict[str, ServerStatus] = {}
+meta_servers: Optional[tuple[float, dict]] = None
+last_activity: dict[int, float] = {}
+hibernated: set[int] = set()
+upstream_budgets: dict[str, UpstreamBudget] = {}
+latency_samples: dict[str, dict[str, deque]] = {}
+response_cache: dict[tuple[str, str], tuple[float, dict]] = {}
+memory_history: deque = deque(maxlen=MEMORY_HISTORY)
+memory_snapshot: Optional[tracemalloc.Snapshot] = None
+supervised: dict[str, SupervisedTask] = {}
+loop_lag: deque = deque(maxlen=LAG_SAMPLES)
+loop_lag_alert = False
+upstream_outcomes: deque = deque(maxlen=UPSTREAM_OUTCOMES)
+governor_level = 0
+governor_calm = 0
+governor_signals: dict[str, float] = {}
+coalesced: dict[int, list[str]] = {}
+prefetched: dict[int, dict[tuple, tuple]] = {}
+prefetch_tasks: dict[int, asyncio.Task] = {}
+prefetch_hits = 0
+prefetch_misses = 0
+
+request_priority: ContextVar[int] = ContextVar("request_priority", default=PRIORITY_INTERACTIVE)
+edit_locks: dict[int, asyncio.Lock] = {}
+chat_edited_at: dict[int, float] = {}
+update_locks: dict[int, asyncio.Lock] = {}
+update_depth: dict[int, int] = {}
+update_depth_samples: deque = deque(maxlen=UPDATE_DEPTH_SAMPLES)
+inflight_updates = 0
+
+background_tasks: set[asyncio.Task] = set()
+log_buffer: list[dict] = []
+log_index = LogIndex()
+timelines: dict[str, dict[str, AdminTimeline]] = {}
+event_streams: set[asyncio.Queue] = set()
+api_runner: Optional[web.AppRunner] = None
+
+shard_id = 0
+shard_db: Optional[sqlite3.Connection] = None
+shard_lock = threading.Lock()
+
+started_at = time.monotonic()
+first_update_at: Optional[float] = None
+
+
+class AuthStates(StatesGroup):
+    waiting_server = State()
+    waiting_login = State()
+    waiting_password = State()
+    waiting_2fa = State()
+
+
+# ===========================================================
+#                        UTILITIES
+# ===========================================================
+
+def format_time(seconds: int) -> str:
+    """Format time from seconds to human readable"""
+    if seconds == 0:
+        return "0m"
+    
+    minutes = seconds // 60
+    hours, mins = divmod(minutes, 60)
+    
+    if hours >= 24:
+        days, hours = divmod(hours, 24)
+        return f"{days}d {hours}h"
+    if hours > 0:
+        return f"{hours}h {mins}m" if mins else f"{hours}h"
+    return f"{mins}m"
+
+
+def get_level_emoji(level: int) -> str:
+    return {4: "[4]", 3: "[3]", 2: "[2]", 1: "[1]"}.get(level, "[?]")
+
+
+def get_level_name(level: int) -> str:
+    return f"Level {level}"
+
+
+def admin_report_count(admin: dict) -> int:
+    reports = admin.get("reports", {})
+    return reports.get("default", 0) + reports.get("moderation", 0)
+
+
+def join_bounded(header: list[str], lines: list[str], footer: list[str], limit: int = TEXT_BUDGET) -> str:
+    """Join text fragments, dropping trailing lines that would exceed the limit"""
+    parts = list(header)
+    length = sum(map(len, parts)) + sum(map(len, footer))
+    
+    for line in lines:
+        if length + len(line) > limit:
+            parts.append("  <i>... truncated</i>\n")
+            break
+        parts.append(line)
+        length += len(line)
+    
+    parts.extend(footer)
+    return "".join(parts)
+
+
+def page_slice(items: list, page: int, per_page: int) -> tuple[list, int, int]:
+    """Clamp the page and return (items on page, page, total pages)"""
+    total_pages = max(1, (len(items) + per_page - 1) // per_page)
+    page = min(max(page, 0), total_pages - 1)
+    return items[page * per_page:(page + 1) * per_page], page, total_pages
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def get_timestamp() -> str:
+    return datetime.now().strftime("%H:%M:%S")
+
+
+def parse_moment(value: str) -> tuple[float, int]:
+    """
+    Parse "DD.MM-HH:MM:SS", "HH:MM:SS" or "HH:MM" as the latest such moment
+    not in the future. Returns the timestamp and its precision in seconds.
+    """
+    now = datetime.now()
+    for fmt in ("%d.%m-%H:%M:%S", "%H:%M:%S", "%H:%M"):
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if fmt.startswith("%d"):
+            moment = parsed.replace(year=now.year)
+            if moment > now:
+                moment = moment.replace(year=now.year - 1)
+        else:
+            moment = now.replace(hour=parsed.hour, minute=parsed.minute, second=parsed.second, microsecond=0)
+            if moment > now:
+                moment -= timedelta(days=1)
+        return moment.timestamp(), 60 if fmt == "%H:%M" else 1
+    raise ValueError(f"Bad time {value!r}, use HH:MM")
+
+
+def start_of_day(moment: float) -> float:
+    return datetime.fromtimestamp(moment).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+
+def spawn_background(coro) -> asyncio.Task:
+    """Run a fire-and-forget coroutine, keeping a reference until it finishes"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+@asynccontextmanager
+async def upstream_slot(url: str, key: str):
+    """Hold one request slot of the url's host at the current request priority"""
+    host = urlsplit(url).netloc
+    if host not in upstream_budgets:
+        upstream_budgets[host] = UpstreamBudget(MAX_UPSTREAM_CONCURRENCY, MAX_UPSTREAM_QPS)
+    budget = upstream_budgets[host]
+    
+    await budget.acquire(request_priority.get(), key)
+    try:
+        yield
+    finally:
+        budget.release()
+
+
+async def fetch_endpoint(session: UserSession, endpoint: str) -> dict:
+    cookies = {"sessionId": session.session_id, "serverId": session.server_id}
+    url = f"{BASE_URL}{endpoint}"
+    async with upstream_slot(url, session.session_id):
+        started = time.monotonic()
+        try:
+            async with asyncio.timeout(ENDPOINT_DEADLINES.get(endpoint, DEFAULT_DEADLINE)):
+                async with aiohttp.ClientSession(cookies=cookies) as http:
+                    async with http.get(url) as resp:
+                        data = await resp.json()
+        except Exception:
+            upstream_outcomes.append((started, time.monotonic() - started, False))
+            raise
+        elapsed = time.monotonic() - started
+        upstream_outcomes.append((started, elapsed, True))
+        record_latency(session.server_id, endpoint, elapsed)
+    
+    if data.get("status"):
+        response_cache[(session.server_id, endpoint)] = (time.time(), data)
+    return data
+
+
+def hedge_delay(session: UserSession, endpoint: str) -> Optional[float]:
+    """Seconds to wait before a second attempt, or None to not hedge"""
+    if not HEDGE_REQUESTS or request_priority.get() != PRIORITY_INTERACTIVE:
+        return None
+    samples = latency_samples.get(session.server_id, {}).get(endpoint, ())
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return max(HEDGE_MIN_DELAY, percentile(sorted(samples), 0.95))
+
+
+async def api_get(session: UserSession, endpoint: str) -> dict:
+    delay = hedge_delay(session, endpoint)
+    if delay is None:
+        return await fetch_endpoint(session, endpoint)
+    
+    attempts = {asyncio.create_task(fetch_endpoint(session, endpoint))}
+    try:
+        done, _ = await asyncio.wait(attempts, timeout=delay)
+        if not done:
+            attempts.add(asyncio.create_task(fetch_endpoint(session, endpoint)))
+        
+        pending = attempts
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for attempt in done:
+                if attempt.exception() is None:
+                    return attempt.result()
+        # Both attempts failed, surface the first one's error
+        return next(iter(done)).result()
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+
+
+# ===========================================================
+#                     CALLBACK DATA
+# ===========================================================
+
+# Bump when the callback layout changes; buttons from older messages then
+# decode as outdated instead of being misread.
+CALLBACK_VERSION = "1"
+CALLBACK_MAX_BYTES = 64
+
+
+@dataclass(frozen=True)
+class CallbackAction:
+    code: str
+    handler: Callable
+    fields: tuple
+    params: frozenset
+
+
+callback_actions: dict[str, CallbackAction] = {}
+
+
+def callback_action(code: str, *fields: type):
+    """Register a callback handler for `code` with typed positional fields"""
+    def register(handler):
+        params = frozenset(inspect.signature(handler).parameters)
+        callback_actions[code] = CallbackAction(code, handler, fields, params)
+        return handler
+    return register
+
+
+def encode_callback(code: str, *args) -> str:
+    data = CALLBACK_VERSION + code
+    if args:
+        data += ":" + ":".join(str(arg) for arg in args)
+    if len(data.encode()) > CALLBACK_MAX_BYTES:
+        raise ValueError(f"Callback data too long: {data}")
+    return data
+
+
+def decode_callback(data: str) -> Optional[tuple[CallbackAction, list]]:
+    """Return the action and its typed arguments, or None if unknown/outdated"""
+    if not data or not data.startswith(CALLBACK_VERSION):
+        return None
+    
+    code, _, tail = data[len(CALLBACK_VERSION):].partition(":")
+    action = callback_actions.get(code)
+    if action is None:
+        return None
+    if not action.fields:
+        return action, []
+    
+    raw = tail.split(":", len(action.fields) - 1)
+    if len(raw) != len(action.fields):
+        return None
+    try:
+        return action, [kind(value) for kind, value in zip(action.fields, raw)]
+    except ValueError:
+        return None
+
+
+def view_callback(code: str, view_type: str, page: int = 0, level_filter: int = 0, admin_login: str = "") -> str:
+    return encode_callback(code, VIEWS[view_type].code, page, level_filter, admin_login)
+
+
+# ===========================================================
+#                        KEYBOARDS
+# ===========================================================
+
+def kb_servers():
+    buttons = []
+    for i in range(1, 17, 4):
+        row = [InlineKeyboardButton(text=f"RU{j}", callback_data=encode_callback("s", f"RU{j}")) 
+               for j in range(i, min(i + 4, 17))]
+        buttons.append(row)
+    buttons.append([InlineKeyboardButton(text="Cancel", callback_data=encode_callback("c"))])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def kb_main():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="Summary", callback_data=view_callback("v", "summary")),
+            InlineKeyboardButton(text="Online", callback_data=view_callback("v", "online"))
+        ],
+        [
+            InlineKeyboardButton(text="Reports", callback_data=view_callback("v", "reports")),
+            InlineKeyboardButton(text="Servers", callback_data=view_callback("v", "servers"))
+        ],
+        [
+            InlineKeyboardButton(text="All Admins", callback_data=view_callback("v", "admins")),
+            InlineKeyboardButton(text="Rates", callback_data=view_callback("v", "rates"))
+        ],
+        [InlineKeyboardButton(text="Settings", callback_data=encode_callback("st"))]
+    ])
+
+
+def kb_view(view_type: str, auto_refresh: bool = True, page: int = 0, total_pages: int = 1):
+    refresh_icon = "||" if auto_refresh else ">"
+    buttons = []
+    
+    if total_pages > 1:
+        nav_row = []
+        if page > 0:
+            nav_row.append(InlineKeyboardButton(text="<", callback_data=view_callback("v", view_type, page - 1)))
+        nav_row.append(InlineKeyboardButton(text=f"{page+1}/{total_pages}", callback_data=encode_callback("n")))
+        if page < total_pages - 1:
+            nav_row.append(InlineKeyboardButton(text=">", callback_data=view_callback("v", view_type, page + 1)))
+        buttons.append(nav_row)
+    
+    buttons.append([
+        InlineKeyboardButton(text="Refresh", callback_data=view_callback("r", view_type, page)),
+        InlineKeyboardButton(text=f"{refresh_icon} Auto", callback_data=view_callback("ta", view_type, page)),
+    ])
+    buttons.append([InlineKeyboardButton(text="< Menu", callback_data=encode_callback("m"))])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def kb_admins_select(admins: list, page: int, total_pages: int, level_filter: int, auto_refresh: bool):
+    buttons = []
+    
+    for i in range(0, len(admins), 2):
+        row = []
+        for admin in admins[i:i+2]:
+            is_online = "* " if admin.get("online", 0) > 0 else ""
+            row.append(InlineKeyboardButton(
+                text=f"{is_online}{admin['login'][:12]}",
+                callback_data=view_callback("v", "admin_profile", admin_login=admin["login"])
+            ))
+        buttons.append(row)
+    
+    level_row = []
+    for lvl in [0, 4, 3, 2, 1]:
+        text = "All" if lvl == 0 else f"L{lvl}"
+        if lvl == level_filter:
+            text = f"[{text}]"
+        level_row.append(InlineKeyboardButton(text=text, callback_data=view_callback("v", "admins", 0, lvl)))
+    buttons.append(level_row)
+    
+    nav_row = []
+    if page > 0:
+        nav_row.append(InlineKeyboardButton(text="<", callback_data=view_callback("v", "admins", page - 1, level_filter)))
+    nav_row.append(InlineKeyboardButton(text=f"{page+1}/{total_pages}", callback_data=encode_callback("n")))
+    if page < total_pages - 1:
+        nav_row.append(InlineKeyboardButton(text=">", callback_data=view_callback("v", "admins", page + 1, level_filter)))
+    buttons.append(nav_row)
+    
+    refresh_icon = "||" if auto_refresh else ">"
+    buttons.append([
+        InlineKeyboardButton(text="Refresh", callback_data=view_callback("r", "admins", page, level_filter)),
+        InlineKeyboardButton(text=f"{refresh_icon} Auto", callback_data=view_callback("ta", "admins", page, level_filter)),
+    ])
+    buttons.append([InlineKeyboardButton(text="< Menu", callback_data=encode_callback("m"))])
+    
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def kb_admin_profile(admin_login: str, is_tracked: bool, auto_refresh: bool):
+    track_text = "Untrack" if is_tracked else "Track"
+    refresh_icon = "||" if auto_refresh else ">"
+    
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=track_text, callback_data=encode_callback("t", admin_login))],
+        [
+            InlineKeyboardButton(text="Refresh", callback_data=view_callback("r", "admin_profile", admin_login=admin_login)),
+            InlineKeyboardButton(text=f"{refresh_icon} Auto", callback_data=view_callback("ta", "admin_profile", admin_login=admin_login)),
+        ],
+        [InlineKeyboardButton(text="< Back", callback_data=view_callback("v", "admins"))],
+        [InlineKeyboardButton(text="< Menu", callback_data=encode_callback("m"))]
+    ])
+
+
+def kb_settings(session: UserSession):
+    notif = "Notifications: ON" if session.notifications else "Notifications: OFF"
+    auto = "Auto-refresh: ON" if session.auto_refresh else "Auto-refresh: OFF"
+    
+    digest = "Daily digest: ON" if session.digest else "Daily digest: OFF"
+    
+    buttons = [
+        [InlineKeyboardButton(text=notif, callback_data=encode_callback("tn"))],
+        [InlineKeyboardButton(text=auto, callback_data=encode_callback("tg"))],
+        [InlineKeyboardButton(text=digest, callback_data=encode_callback("td"))],
+    ]
+    
+    for login in session.watchlist:
+        buttons.append([InlineKeyboardButton(
+            text=f"Untrack {login}", 
+            callback_data=encode_callback("ut", login)
+        )])
+    
+    buttons.append([InlineKeyboardButton(text=f"Alert rules ({len(session.rules)})", callback_data=encode_callback("rl"))])
+    buttons.append([InlineKeyboardButton(text="Logout", callback_data=encode_callback("lo"))])
+    buttons.append([InlineKeyboardButton(text="< Menu", callback_data=encode_callback("m"))])
+    
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def kb_rules(session: UserSession):
+    buttons = [
+        [InlineKeyboardButton(text=f"Delete: {describe_rule(rule)}", callback_data=encode_callback("rd", i))]
+        for i, rule in enumerate(session.rules)
+    ]
+    buttons.append([InlineKeyboardButton(text="< Settings", callback_data=encode_callback("st"))])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def kb_guest():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Login", callback_data=encode_callback("li"))]
+    ])
+
+
+# ===========================================================
+#                   CONTENT GENERATORS
+# ===========================================================
+
+def generate_summary(session: UserSession, live: LiveMessage, data: dict):
+    r = data["/admin/reports/statistics"].get("result", {})
+    admins = data["/admin/admins"].get("result", [])
+    servers = data["/meta/servers"].get("result", {}).get("servers", [])
+    
+    online_admins = [a for a in admins if a.get("online", 0) > 0]
+    total_reports = sum(admin_report_count(a) for a in admins)
+    
+    ru_servers = [s for s in servers if s["id"].startswith("ru")]
+    total_players = sum(s.get("players", 0) for s in ru_servers)
+    
+    my_server = next((s for s in servers if s["id"].lower() == session.server_id.lower()), None)
+    my_server_info = ""
+    if my_server:
+        my_players = my_server.get("players", 0)
+        my_queue = my_server.get("queuedPlayers", 0)
+        my_status = "ON" if my_server.get("status") else "OFF"
+        queue_str = f" (+{my_queue})" if my_queue > 0 else ""
+        my_server_info = f"\nYour server ({my_server['name']}): {my_status} {my_players}{queue_str}"
+    
+    text = (
+        f"<b>Summary</b>\n"
+        f"{'='*20}\n\n"
+        f"<b>Reports:</b>\n"
+        f"  Moderation: <b>{r.get('moderation', 0)}</b>\n"
+        f"  In progress: <b>{r.get('progress', 0)}</b>\n"
+        f"  Unresolved: <b>{r.get('unresolved', 0)}</b>\n"
+        f"  At admins: <b>{total_reports}</b>\n\n"
+        f"<b>Admins:</b> {len(online_admins)}/{len(admins)} online\n"
+        f"<b>Players:</b> {total_players}{my_server_info}\n\n"
+        f"<i>Updated: {get_timestamp()}</i>"
+    )
+    return text, kb_view("summary", session.auto_refresh)
+
+
+def generate_online(session: UserSession, live: LiveMessage, data: dict):
+    admins = data["/admin/admins"].get("result", [])
+    online = sorted(
+        (a for a in admins if a.get("online", 0) > 0),
+        key=lambda x: (x.get("admin", 0), x.get("dayOnline", 0)),
+        reverse=True
+    )
+    page_admins, page, total_pages = page_slice(online, live.page, ONLINE_PER_PAGE)
+    
+    header = [
+        f"<b>Admins Online</b>\n",
+        f"{'='*20}\n",
+        f"Online: <b>{len(online)}</b> / {len(admins)}\n\n",
+    ]
+    
+    lines = []
+    level = None
+    for admin in page_admins:
+        lvl = admin.get("admin", 0)
+        if lvl != level:
+            if level is not None:
+                lines.append("\n")
+            lines.append(f"<b>{get_level_name(lvl)}</b>\n")
+            level = lvl
+        # dayOnline = online time today (in seconds)
+        time_str = format_time(admin.get("dayOnline", 0))
+        rep = admin_report_count(admin)
+        rep_str = f" [R:{rep}]" if rep > 0 else ""
+        lines.append(f"  * {admin['login']} <code>({time_str})</code>{rep_str}\n")
+    
+    if not online:
+        lines.append("No one online\n")
+    
+    text = join_bounded(header, lines, [f"\n<i>Updated: {get_timestamp()}</i>"])
+    return text, kb_view("online", session.auto_refresh, page, total_pages)
+
+
+def generate_reports(session: UserSession, live: LiveMessage, data: dict):
+    r = data["/admin/reports/statistics"].get("result", {})
+    admins = data["/admin/admins"].get("result", [])
+    
+    admin_reports = []
+    for admin in admins:
+        count = admin_report_count(admin)
+        if count > 0:
+            is_online = admin.get("online", 0) > 0
+            admin_reports.append((admin["login"], count, is_online, admin.get("admin", 0)))
+    
+    admin_reports.sort(key=lambda x: x[1], reverse=True)
+    total = sum(x[1] for x in admin_reports)
+    page_reports, page, total_pages = page_slice(admin_reports, live.page, REPORTS_PER_PAGE)
+    
+    header = [
+        f"<b>Reports</b>\n",
+        f"{'='*20}\n\n",
+        f"<b>Statistics:</b>\n",
+        f"  Moderation: <b>{r.get('moderation', 0)}</b>\n",
+        f"  In progress: <b>{r.get('progress', 0)}</b>\n",
+        f"  Unresolved: <b>{r.get('unresolved', 0)}</b>\n\n",
+    ]
+    
+    lines = []
+    if admin_reports:
+        header.append(f"<b>At admins</b> ({total}):\n")
+        for login, count, is_online, lvl in page_reports:
+            status = "*" if is_online else " "
+            lines.append(f"  {status} {get_level_emoji(lvl)} {login}: <b>{count}</b>\n")
+    
+    text = join_bounded(header, lines, [f"\n<i>Updated: {get_timestamp()}</i>"])
+    return text, kb_view("reports", session.auto_refresh, page, total_pages)
+
+
+def generate_servers(session: UserSession, live: LiveMessage, data: dict):
+    servers = data["/meta/servers"].get("result", {}).get("servers", [])
+    
+    ru_servers = sorted(
+        [s for s in servers if s["id"].startswith("ru")],
+        key=lambda x: int(x["id"][2:]) if x["id"][2:].isdigit() else 99
+    )
+    
+    total = sum(s.get("players", 0) for s in ru_servers)
+    queue = sum(s.get("queuedPlayers", 0) for s in ru_servers)
+    
+    text = (
+        f"<b>Servers</b>\n"
+        f"{'='*20}\n"
+        f"Total: <b>{total}</b>"
+    )
+    if queue > 0:
+        text += f" (+{queue} in queue)"
+    text += "\n\n"
+    
+    for s in ru_servers:
+        status = "+" if s.get("status") else "-"
+        tech = " [TECH]" if s.get("techWorks") else ""
+        players = s.get("players", 0)
+        q = s.get("queuedPlayers", 0)
+        q_str = f" <i>(+{q})</i>" if q > 0 else ""
+        known = server_statuses.get(s["id"].lower())
+        if q > 0 and known and known.drain_rate > 0:
+            q_str = f" <i>(+{q}, -{known.drain_rate:.0f}/min)</i>"
+        text += f"{status} <b>{s['name']}</b>: {players}{q_str}{tech}\n"
+    
+    text += f"\n<i>Updated: {get_timestamp()}</i>"
+    return text, kb_view("servers", session.auto_refresh)
+
+
+def ranked_admins(all_admins: list, level_filter: int) -> list:
+    admins = all_admins
+    if level_filter > 0:
+        admins = [a for a in admins if a.get("admin", 0) == level_filter]
+    return sorted(admins, key=lambda x: x.get("weekOnline", 0), reverse=True)
+
+
+def generate_admins_with_buttons(session: UserSession, live: LiveMessage, data: dict):
+    all_admins = data["/admin/admins"].get("result", [])
+    level_filter = live.level_filter
+    admins = ranked_admins(all_admins, level_filter)
+    page_admins, page, total_pages = page_slice(admins, live.page, ADMINS_PER_PAGE)
+    
+    filter_text = f"Level {level_filter}" if level_filter > 0 else "All levels"
+    
+    tracked_info = ""
+    if session.watchlist:
+        watched = set(session.watchlist)
+        lines = []
+        for tracked in all_admins:
+            if tracked["login"] in watched:
+                is_on = "*" if tracked.get("online", 0) > 0 else " "
+                lines.append(f"{is_on} <b>{tracked['login']}</b> (R:{admin_report_count(tracked)})")
+        if lines:
+            tracked_info = "\nTracking:\n" + "\n".join(f"  {line}" for line in lines) + "\n"
+    
+    text = (
+        f"<b>Admins</b> ({len(admins)})\n"
+        f"{'='*20}\n"
+        f"Filter: <b>{filter_text}</b>{tracked_info}\n"
+        f"<i>Select admin for details:</i>\n\n"
+        f"<i>Updated: {get_timestamp()}</i>"
+    )
+    
+    kb = kb_admins_select(page_admins, page, total_pages, level_filter, session.auto_refresh)
+    return text, kb
+
+
+def generate_admin_profile(session: UserSession, live: LiveMessage, data: dict):
+    admins = data["/admin/admins"].get("result", [])
+    admin_login = live.admin_login
+    kb = kb_admin_profile(admin_login, admin_login in session.watchlist, session.auto_refresh)
+    
+    admin = next((a for a in admins if a["login"] == admin_login), None)
+    if not admin:
+        return f"Admin <b>{admin_login}</b> not found", kb
+    
+    is_online = "ONLINE" if admin.get("online", 0) > 0 else "OFFLINE"
+    
+    reports = admin.get("reports", {})
+    rep_default = reports.get("default", 0)
+    rep_mod = reports.get("moderation", 0)
+    rep_total = rep_default + rep_mod
+    
+    other = admin.get("otherAccountsOnline", {})
+    
+    text = (
+        f"<b>{admin['login']}</b>\n"
+        f"{'='*20}\n\n"
+        f"{get_level_name(admin.get('admin', 0))}\n"
+        f"Status: {is_online}"
+    )
+    
+    if admin.get("online", 0) > 0:
+        text += f" ({format_time(admin.get('online', 0))})"
+    
+    text += (
+        f"\n\n<b>Online time:</b>\n"
+        f"  Today: <b>{format_time(admin.get('dayOnline', 0))}</b>\n"
+        f"  Week: <b>{format_time(admin.get('weekOnline', 0))}</b>\n"
+        f"  Month: <b>{format_time(admin.get('monthOnline', 0))}</b>\n\n"
+        f"<b>Reports:</b> {rep_total}\n"
+        f"  Default: {rep_default}\n"
+        f"  Moderation: {rep_mod}\n"
+    )
+    
+    if any(other.values()):
+        text += (
+            f"\n<b>Other accounts:</b>\n"
+            f"  Week: {format_time(other.get('weekOnline', 0))}\n"
+            f"  Month: {format_time(other.get('monthOnline', 0))}\n"
+        )
+    
+    text += timeline_text(session.server_id, admin_login)
+    text += f"\n<i>Updated: {get_timestamp()}</i>"
+    return text, kb
+
+
+def generate_rates(session: UserSession, live: LiveMessage, data: dict):
+    rates = queue_rates.get(session.server_id)
+    metrics = server_metrics.get(session.server_id)
+    
+    text = (
+        f"<b>Queue rates</b> (last {RATE_WINDOW // 60}m)\n"
+        f"{'='*20}\n\n"
+    )
+    
+    kb = kb_view("rates", session.auto_refresh)
+    if not rates or not metrics:
+        text += "No data yet, rates are collected while monitoring is on\n\n" + f"<i>Updated: {get_timestamp()}</i>"
+        return text, kb
+    
+    now = time.time()
+    rates.backlog.expire(now)
+    dropped = (
+        f"{format_time(int(now - rates.unresolved_dropped_at))} ago"
+        if rates.unresolved_dropped_at else "not seen"
+    )
+    
+    text += (
+        f"New reports: <b>{rates.per_minute(rates.new_reports, now):.1f}</b>/min\n"
+        f"Closed: <b>{rates.per_minute(rates.closed, now):.1f}</b>/min\n"
+        f"Backlog: <b>{rates.backlog.total:+d}</b> (unresolved {metrics[('unresolved', '')]})\n"
+        f"Last decrease: {dropped}\n"
+    )
+    
+    closers = []
+    for login, window in list(rates.admin_closed.items()):
+        window.expire(now)
+        if window.total > 0:
+            closers.append((login, window.total))
+        else:
+            del rates.admin_closed[login]
+    closers.sort(key=lambda x: x[1], reverse=True)
+    
+    if closers:
+        text += "\n<b>Closed by admin:</b>\n"
+        for login, count in closers[:10]:
+            text += f"  {login}: <b>{count}</b> ({rates.per_minute(rates.admin_closed[login], now):.2f}/min)\n"
+    
+    text += f"\n<i>Updated: {get_timestamp()}</i>"
+    return text, kb
+
+
+def menu_text(session: UserSession) -> str:
+    return f"<b>{session.login}</b> | {session.server_id}\n\nSelect action:"
+
+
+def settings_text(session: UserSession) -> str:
+    tracked_info = ""
+    if session.watchlist:
+        tracked_info = "\nTracking: " + ", ".join(f"<b>{login}</b>" for login in session.watchlist)
+    
+    return (
+        f"<b>Settings</b>\n\n"
+        f"Account: <b>{session.login}</b>\n"
+        f"Server: <code>{session.server_id}</code>\n"
+        f"{get_level_name(session.admin_level)}{tracked_info}"
+    )
+
+
+def rules_text(session: UserSession) -> str:
+    text = f"<b>Alert rules</b>\n{'='*20}\n\n"
+    if session.rules:
+        text += "\n".join(
+            f"{i + 1}. {html.escape(describe_rule(rule))}{' [firing]' if rule.active else ''}"
+            for i, rule in enumerate(session.rules)
+        )
+    else:
+        text += "No rules"
+    text += (
+        "\n\n<i>Add with /rule, e.g.</i>\n"
+        "<code>/rule reports LOGIN &gt; 5</code>\n"
+        "<code>/rule online 4 &lt; 2</code>\n"
+        "<code>/rule unresolved &gt; 50</code>\n"
+        "<code>/rule unresolved +10 5m</code>"
+    )
+    return text
+
+
+# ===========================================================
+#                      VIEW REGISTRY
+# ===========================================================
+
+@dataclass(frozen=True)
+class ViewSpec:
+    name: str
+    code: str
+    endpoints: tuple
+    render: Callable
+
+
+VIEWS: dict[str, ViewSpec] = {spec.name: spec for spec in (
+    ViewSpec("summary", "su", ("/admin/reports/statistics", "/admin/admins", "/meta/servers"), generate_summary),
+    ViewSpec("online", "on", ("/admin/admins",), generate_online),
+    ViewSpec("reports", "re", ("/admin/reports/statistics", "/admin/admins"), generate_reports),
+    ViewSpec("servers", "se", ("/meta/servers",), generate_servers),
+    ViewSpec("rates", "ra", (), generate_rates),
+    ViewSpec("admins", "ad", ("/admin/admins",), generate_admins_with_buttons),
+    ViewSpec("admin_profile", "pr", ("/admin/admins",), generate_admin_profile),
+)}
+VIEW_CODES: dict[str, str] = {spec.code: spec.name for spec in VIEWS.values()}
+
+
+async def load_view_data(session: UserSession, spec: ViewSpec) -> dict:
+    """Fetch every endpoint the view depends on, concurrently"""
+    data = {}
+    if "/meta/servers" in spec.endpoints and meta_servers is not None:
+        fetched_at, servers = meta_servers
+        if time.time() - fetched_at < SERVERS_POLL_INTERVAL * 2:
+            data["/meta/servers"] = servers
+    
+    endpoints = [endpoint for endpoint in spec.endpoints if endpoint not in data]
+    results = await asyncio.gather(*(api_get(session, endpoint) for endpoint in endpoints))
+    data.update(zip(endpoints, results))
+    return data
+
+
+def cached_view_data(session: UserSession, spec: ViewSpec) -> Optional[tuple[dict, float]]:
+    """Last good responses for every endpoint of the view, and when the oldest was fetched"""
+    cached = [response_cache.get((session.server_id, endpoint)) for endpoint in spec.endpoints]
+    if None in cached:
+        return None
+    fetched_at = min((at for at, _ in cached), default=time.time())
+    return {endpoint: data for endpoint, (_, data) in zip(spec.endpoints, cached)}, fetched_at
+
+
+async def render_view(session: UserSession, live: LiveMessage):
+    spec = VIEWS[live.view_type]
+    try:
+        async with asyncio.timeout(VIEW_DEADLINE):
+            data = await load_view_data(session, spec)
+    except (TimeoutError, UpstreamBusy, aiohttp.ClientError):
+        cached = cached_view_data(session, spec)
+        if cached is None:
+            raise
+        data, fetched_at = cached
+        text, kb = spec.render(session, live, data)
+        stale = datetime.fromtimestamp(fetched_at).strftime("%H:%M:%S")
+        return text + f"\n<i>Stale: panel is slow, showing data from {stale}</i>", kb
+    
+    return spec.render(session, live, data)
+
+
+# ===========================================================
+#                    AUTO-REFRESH SYSTEM
+# ===========================================================
+
+def snapshot_view_data(spec: ViewSpec, snapshot: ServerSnapshot) -> Optional[dict]:
+    """The view's endpoint responses, built from polled data instead of fetching"""
+    data = {}
+    for endpoint in spec.endpoints:
+        if endpoint == "/admin/admins":
+            data[endpoint] = {"status": True, "result": snapshot.admins}
+        elif endpoint == "/admin/reports/statistics":
+            data[endpoint] = {"status": True, "result": snapshot.stats}
+        elif endpoint == "/meta/servers" and meta_servers is not None:
+            data[endpoint] = meta_servers[1]
+        else:
+            return None
+    return data
+
+
+def visible_content(text: str, kb) -> tuple:
+    """What an edit would change, ignoring the "Updated" timestamp"""
+    return text.rsplit("<i>Updated:", 1)[0], kb
+
+
+async def wait_edit_slot(chat_id: int):
+    # Reserve the slot before sleeping so concurrent editors queue up behind it
+    now = time.monotonic()
+    slot = max(now, chat_edited_at.get(chat_id, 0.0) + MIN_EDIT_SPACING)
+    chat_edited_at[chat_id] = slot
+    if slot > now:
+        await asyncio.sleep(slot - now)
+
+
+def last_snapshot_time(server_id: str) -> float:
+    snapshot = server_snapshots.get(server_id)
+    return snapshot.fetched_at if snapshot else 0.0
+
+
+async def auto_refresh_loop(user_id: int):
+    """Re-render the live view from each new snapshot, editing only when it changed"""
+    session = user_sessions.get(user_id)
+    # The click that started this loop has just rendered the current snapshot
+    seen = last_snapshot_time(session.server_id) if session else 0.0
+    shown = None
+    
+    while user_id in user_sessions and user_id in live_messages:
+        session = user_sessions[user_id]
+        snapshot = await wait_snapshot(session.server_id, seen)
+        seen = snapshot.fetched_at
+        
+        live = live_messages.get(user_id)
+        if not live or live.view_type not in VIEWS:
+            break
+        if not session.auto_refresh or view_paused(user_id):
+            continue
+        
+        data = snapshot_view_data(VIEWS[live.view_type], snapshot)
+        if data is None:
+            continue
+            
+        try:
+            text, kb = VIEWS[live.view_type].render(session, live, data)
+            content = (live, visible_content(text, kb))
+            if content == shown:
+                continue
+            
+            await wait_edit_slot(live.chat_id)
+            async with edit_lock(user_id):
+                # A click on this message since the snapshot arrived has newer content
+                if live_messages.get(user_id) is live and (user_id, live.message_id) not in view_jobs:
+                    await bot.edit_message_text(
+                        text=text,
+                        chat_id=live.chat_id,
+                        message_id=live.message_id,
+                        parse_mode="HTML",
+                        reply_markup=kb
+                    )
+                    shown = content
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                if user_id in live_messages:
+                    del live_messages[user_id]
+                break
+        except Exception:
+            pass
+
+
+def start_auto_refresh(user_id: int):
+    if user_id in refresh_tasks:
+        refresh_tasks[user_id].cancel()
+    # Waits on snapshots, so a stalled poller is what gets flagged as stuck
+    refresh_tasks[user_id] = supervise(
+        f"refresh:{user_id}", auto_refresh_loop(user_id), lambda: start_auto_refresh(user_id)
+    )
+    if user_id in user_sessions:
+        ensure_server_poller(user_sessions[user_id].server_id)
+
+
+def stop_auto_refresh(user_id: int):
+    unsupervise(f"refresh:{user_id}")
+    if user_id in refresh_tasks:
+        refresh_tasks[user_id].cancel()
+        del refresh_tasks[user_id]
+    if user_id in live_messages:
+        del live_messages[user_id]
+    stop_prefetch(user_id)
+
+
+# ===========================================================
+#                       PREFETCH
+# ===========================================================
+
+def view_key(live: LiveMessage) -> tuple:
+    return live.view_type, live.page, live.level_filter, live.admin_login
+
+
+def render_state(session: UserSession) -> tuple:
+    """Session fields a rendered view depends on besides the fetched data"""
+    return session.server_id, session.auto_refresh, tuple(session.watchlist)
+
+
+def prefetch_candidates(live: LiveMessage, data: dict) -> list[LiveMessage]:
+    """Views likely to be opened next from `live`, most likely first"""
+    if live.view_type != "admins":
+        return []
+    
+    def view(view_type: str, **fields) -> LiveMessage:
+        return LiveMessage(live.chat_id, live.message_id, view_type, **fields)
+    
+    admins = ranked_admins(data["/admin/admins"].get("result", []), live.level_filter)
+    page_admins, page, total_pages = page_slice(admins, live.page, ADMINS_PER_PAGE)
+    
+    candidates = [view("admin_profile", admin_login=admin["login"]) for admin in page_admins[:PREFETCH_TOP_PROFILES]]
+    if page < total_pages - 1:
+        candidates.insert(1, view("admins", page=page + 1, level_filter=live.level_filter))
+    if page > 0:
+        candidates.append(view("admins", page=page - 1, level_filter=live.level_filter))
+    candidates.extend(view("admins", level_filter=lvl) for lvl in (0, 4, 3, 2, 1) if lvl != live.level_filter)
+    return candidates[:PREFETCH_BUDGET]
+
+
+async def prefetch_views(user_id: int, live: LiveMessage):
+    """Fetch at the lowest priority and pre-render the views likely to follow `live`"""
+    request_priority.set(PRIORITY_PREFETCH)
+    session = user_sessions.get(user_id)
+    if session is None:
+        return
+    
+    spec = VIEWS[live.view_type]
+    cached = cached_view_data(session, spec)
+    if cached is None or time.time() - cached[1] > PREFETCH_TTL / 2:
+        try:
+            cached = await load_view_data(session, spec), time.time()
+        except Exception:
+            return
+    data, fetched_at = cached
+    
+    ready = {}
+    prefetched[user_id] = ready
+    state = render_state(session)
+    for candidate in prefetch_candidates(live, data):
+        try:
+            text, kb = VIEWS[candidate.view_type].render(session, candidate, data)
+        except Exception:
+            continue
+        ready[view_key(candidate)] = (fetched_at, state, text, kb)
+        # Rendering many pages in a row would hold up other updates
+        await asyncio.sleep(0)
+
+
+def start_prefetch(user_id: int, live: LiveMessage):
+    stop_prefetch(user_id)
+    if governor_level or live.view_type != "admins":
+        return
+    prefetch_tasks[user_id] = spawn_background(prefetch_views(user_id, live))
+
+
+def stop_prefetch(user_id: int):
+    task = prefetch_tasks.pop(user_id, None)
+    if task is not None:
+        task.cancel()
+    prefetched.pop(user_id, None)
+
+
+def take_prefetched(user_id: int, session: UserSession, live: LiveMessage) -> Optional[tuple]:
+    """The pre-rendered text and keyboard for `live`, if still fresh"""
+    global prefetch_hits, prefetch_misses
+    if user_id not in prefetched:
+        return None
+    
+    entry = prefetched[user_id].pop(view_key(live), None)
+    if entry is None or time.time() - entry[0] > PREFETCH_TTL or entry[1] != render_state(session):
+        prefetch_misses += 1
+        return None
+    prefetch_hits += 1
+    return entry[2], entry[3]
+
+
+async def prefetched_view(user_id: int, session: UserSession, live: LiveMessage):
+    ready = take_prefetched(user_id, session, live)
+    if ready is not None:
+        return ready
+    return await render_view(session, live)
+
+
+# ===========================================================
+#                    GROUP DASHBOARDS
+# ===========================================================
+
+DASHBOARD_VIEWS = ("summary", "online", "reports", "servers")
+
+
+async def dashboard_loop(key: tuple[int, str]):
+    """Re-render one shared dashboard message from its owner's server snapshots"""
+    seen = 0.0
+    shown = None
+    while key in dashboards:
+        dashboard = dashboards.get(key)
+        session = user_sessions.get(dashboard.owner_id) if dashboard else None
+        if session is None:
+            break
+        if not seen:
+            # Posting rendered the current snapshot
+            seen = last_snapshot_time(session.server_id)
+        
+        snapshot = await wait_snapshot(session.server_id, seen)
+        seen = snapshot.fetched_at
+        
+        live = LiveMessage(dashboard.chat_id, dashboard.message_id, dashboard.view_type)
+        data = snapshot_view_data(VIEWS[live.view_type], snapshot)
+        if data is None:
+            continue
+        
+        try:
+            text, _ = VIEWS[live.view_type].render(session, live, data)
+            content = visible_content(text, None)
+            if content == shown:
+                continue
+            
+            await wait_edit_slot(dashboard.chat_id)
+            await bot.edit_message_text(
+                text=text,
+                chat_id=dashboard.chat_id,
+                message_id=dashboard.message_id,
+                parse_mode="HTML"
+            )
+            shown = content
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                break
+        except Exception:
+            pass
+    
+    dashboards.pop(key, None)
+    if dashboard_tasks.get(key) is asyncio.current_task():
+        del dashboard_tasks[key]
+
+
+def start_dashboard(dashboard: Dashboard):
+    key = (dashboard.chat_id, dashboard.view_type)
+    stop_dashboard(key)
+    dashboards[key] = dashboard
+    run_dashboard(key)
+
+
+def run_dashboard(key: tuple[int, str]):
+    dashboard_tasks[key] = supervise(f"dashboard:{key[0]}:{key[1]}", dashboard_loop(key), lambda: run_dashboard(key))
+    dashboard = dashboards.get(key)
+    if dashboard and dashboard.owner_id in user_sessions:
+        ensure_server_poller(user_sessions[dashboard.owner_id].server_id)
+
+
+def stop_dashboard(key: tuple[int, str]):
+    unsupervise(f"dashboard:{key[0]}:{key[1]}")
+    dashboards.pop(key, None)
+    task = dashboard_tasks.pop(key, None)
+    if task:
+        task.cancel()
+
+
+def stop_user_dashboards(user_id: int):
+    for key, dashboard in list(dashboards.items()):
+        if dashboard.owner_id == user_id:
+            stop_dashboard(key)
+
+
+async def can_post_dashboard(chat_id: int, user_id: int) -> bool:
+    """Posting into another chat (e.g. a channel) requires administering it"""
+    try:
+        member = await bot.get_chat_member(chat_id, user_id)
+    except TelegramBadRequest:
+        return False
+    return member.status in ("creator", "administrator")
+
+
+async def can_manage_dashboard(dashboard: Dashboard, user_id: int) -> bool:
+    """Stopping or replacing someone else's dashboard requires administering its chat"""
+    return dashboard.owner_id == user_id or await can_post_dashboard(dashboard.chat_id, user_id)
+
+
+# ===========================================================
+#                   LATEST-WINS RENDERING
+# ===========================================================
+
+def edit_lock(user_id: int) -> asyncio.Lock:
+    if user_id not in edit_locks:
+        edit_locks[user_id] = asyncio.Lock()
+    return edit_locks[user_id]
+
+
+async def show_latest(callback: CallbackQuery, build) -> bool:
+    """
+    Render `build` (a coroutine returning text and keyboard) into the
+    callback's message. A newer call for the same user and message cancels
+    this fetch/render, and edits are serialized per user so an older result
+    never lands after a newer one. Returns False if superseded.
+    """
+    user_id = callback.from_user.id
+    key = (user_id, callback.message.message_id)
+    
+    previous = view_jobs.get(key)
+    if previous is not None:
+        previous.cancel()
+    
+    job = asyncio.create_task(build)
+    view_jobs[key] = job
+    try:
+        try:
+            text, kb = await job
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise
+            return False
+        
+        async with edit_lock(user_id):
+            if view_jobs.get(key) is not job:
+                return False
+            await callback.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
+        return True
+    finally:
+        if view_jobs.get(key) is job:
+            del view_jobs[key]
+
+
+# ===========================================================
+#                     SERVER POLLING
+# ===========================================================
+
+async def fetch_server_snapshot(session: UserSession) -> Optional[ServerSnapshot]:
+    started = time.time()
+    admins_data = await api_get(session, "/admin/admins")
+    # Each fetch may queue for the budget and then run to its deadline, so
+    # the poller reports progress between them rather than once per round
+    heartbeat()
+    stats_data = await api_get(session, "/admin/reports/statistics")
+    
+    if not admins_data.get("status") or not stats_data.get("status"):
+        return None
+    
+    return ServerSnapshot(session.server_id, admins_data["result"], stats_data["result"], time.time(), started)
+
+
+def server_monitors(server_id: str) -> list[UserSession]:
+    """
+    Sessions that want snapshots of the server: monitoring with notifications
+    on, or showing a live view or a dashboard
+    """
+    viewers = {
+        *(user_id for user_id in refresh_tasks if user_id in user_sessions and user_sessions[user_id].auto_refresh),
+        *(dashboard.owner_id for dashboard in dashboards.values()),
+    }
+    return [
+        user_sessions[user_id] for user_id in [*monitor_tasks, *viewers]
+        if user_id in user_sessions and user_sessions[user_id].server_id == server_id
+        and (user_sessions[user_id].notifications or user_id in viewers)
+    ]
+
+
+async def poll_server(server_id: str) -> Optional[ServerSnapshot]:
+    """Fetch a snapshot using the first working session on the server"""
+    for session in server_monitors(server_id):
+        try:
+            snapshot = await fetch_server_snapshot(session)
+        except Exception:
+            # Slow or failing panel: trying more sessions would only add load
+            return None
+        if snapshot:
+            return snapshot
+        # Rejected (expired login): try the next session
+    return None
+
+
+def snapshot_condition(server_id: str) -> asyncio.Condition:
+    if server_id not in snapshot_conditions:
+        snapshot_conditions[server_id] = asyncio.Condition()
+    return snapshot_conditions[server_id]
+
+
+async def store_snapshot(snapshot: ServerSnapshot):
+    server_id = snapshot.server_id
+    events = snapshot_events(server_snapshots.get(server_id), snapshot)
+    publish_events(events)
+    log_buffer.extend(events)
+    update_timeline(snapshot)
+    server_snapshots[server_id] = snapshot
+    if snapshot.fetch_started:
+        record_latency(server_id, "fetch", snapshot.fetched_at - snapshot.fetch_started)
+    
+    metrics = snapshot_metrics(snapshot)
+    previous = server_metrics.get(server_id)
+    server_metrics[server_id] = metrics
+    update_queue_rates(server_id, previous, metrics, snapshot.fetched_at)
+    update_digest(server_id, previous, metrics, snapshot.fetched_at)
+    evaluate_rules(server_id, previous, metrics, snapshot.fetched_at)
+    
+    cond = snapshot_condition(snapshot.server_id)
+    async with cond:
+        cond.notify_all()
+
+
+async def wait_snapshot(server_id: str, after: float) -> ServerSnapshot:
+    """Wait for a snapshot of the server newer than `after`"""
+    def is_newer():
+        snapshot = server_snapshots.get(server_id)
+        return snapshot is not None and snapshot.fetched_at > after
+    
+    cond = snapshot_condition(server_id)
+    async with cond:
+        await cond.wait_for(is_newer)
+    return server_snapshots[server_id]
+
+
+async def server_poll_loop(server_id: str, delay: float = 0.0):
+    request_priority.set(PRIORITY_MONITOR)
+    try:
+        await asyncio.sleep(delay)
+        while server_monitors(server_id):
+            heartbeat()
+            if await shard_call(claim_server, server_id):
+                snapshot = await poll_server(server_id)
+                if snapshot:
+                    await shard_call(publish_snapshot, snapshot)
+                delay = MONITOR_INTERVAL * refresh_stretch()
+            else:
+                last = server_snapshots.get(server_id)
+                snapshot = await shard_call(load_shared_snapshot, server_id, last.fetched_at if last else 0.0)
+                delay = SHARED_SNAPSHOT_POLL
+            
+            if snapshot:
+                await store_snapshot(snapshot)
+            
+            heartbeat()
+            await asyncio.sleep(delay)
+    finally:
+        await shard_call(release_server, server_id)
+        if server_pollers.get(server_id) is asyncio.current_task():
+            del server_pollers[server_id]
+
+
+def ensure_server_poller(server_id: str, delay: float = 0.0):
+    task = server_pollers.get(server_id)
+    if task is None or task.done():
+        server_pollers[server_id] = supervise(
+            f"poller:{server_id}", server_poll_loop(server_id, delay),
+            lambda: restart_server_poller(server_id), MONITOR_INTERVAL
+        )
+
+
+def restart_server_poller(server_id: str):
+    # A stuck poller is cancelled but still counts as running until it unwinds
+    server_pollers.pop(server_id, None)
+    ensure_server_poller(server_id)
+
+
+# ===========================================================
+#                  SHARD COORDINATION
+# ===========================================================
+
+def open_shard_db() -> sqlite3.Connection:
+    # Queries run in worker threads (see shard_call) so a busy database never
+    # blocks the event loop
+    db = sqlite3.connect(SHARD_DB_PATH, timeout=5, isolation_level=None, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS leases "
+        "(server_id TEXT PRIMARY KEY, owner INTEGER NOT NULL, expires REAL NOT NULL)"
+    )
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS snapshots "
+        "(server_id TEXT PRIMARY KEY, fetched_at REAL NOT NULL, payload TEXT NOT NULL)"
+    )
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS meta_servers "
+        "(id INTEGER PRIMARY KEY CHECK (id = 0), fetched_at REAL NOT NULL, payload TEXT NOT NULL)"
+    )
+    return db
+
+
+def locked_shard_call(func: Callable, *args):
+    with shard_lock:
+        return func(*args)
+
+
+async def shard_call(func: Callable, *args):
+    """
+    Run a shard database function in a worker thread. Calls are serialized:
+    the threads share one connection, and claim_server reads its change
+    count. Unsharded the functions are no-ops and run inline.
+    """
+    if shard_db is None:
+        return func(*args)
+    return await asyncio.to_thread(locked_shard_call, func, *args)
+
+
+def claim_server(server_id: str, ttl: float = SERVER_LEASE_TTL) -> bool:
+    """Take or renew the polling lease for a server; always granted unsharded"""
+    if shard_db is None:
+        return True
+    
+    now = time.time()
+    cur = shard_db.execute(
+        "INSERT INTO leases (server_id, owner, expires) VALUES (?, ?, ?) "
+        "ON CONFLICT(server_id) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+        "WHERE leases.owner = excluded.owner OR leases.expires < ?",
+        # Outlive the poll interval, which degraded mode stretches
+        (server_id, shard_id, now + ttl * refresh_stretch(), now)
+    )
+    return cur.rowcount > 0
+
+
+def release_server(server_id: str):
+    if shard_db is None:
+        return
+    shard_db.execute("DELETE FROM leases WHERE server_id = ? AND owner = ?", (server_id, shard_id))
+
+
+def publish_snapshot(snapshot: ServerSnapshot):
+    if shard_db is None:
+        return
+    payload = json.dumps({"admins": snapshot.admins, "stats": snapshot.stats, "fetch_started": snapshot.fetch_started})
+    shard_db.execute(
+        "INSERT OR REPLACE INTO snapshots (server_id, fetched_at, payload) VALUES (?, ?, ?)",
+        (snapshot.server_id, snapshot.fetched_at, payload)
+    )
+
+
+def load_shared_snapshot(server_id: str, after: float) -> Optional[ServerSnapshot]:
+    if shard_db is None:
+        return None
+    row = shard_db.execute(
+        "SELECT fetched_at, payload FROM snapshots WHERE server_id = ? AND fetched_at > ?",
+        (server_id, after)
+    ).fetchone()
+    if not row:
+        return None
+    payload = json.loads(row[1])
+    return ServerSnapshot(server_id, payload["admins"], payload["stats"], row[0], payload.get("fetch_started", 0.0))
+
+
+def publish_meta_servers(fetched_at: float, data: dict):
+    if shard_db is None:
+        return
+    shard_db.execute(
+        "INSERT OR REPLACE INTO meta_servers (id, fetched_at, payload) VALUES (0, ?, ?)",
+        (fetched_at, json.dumps(data))
+    )
+
+
+def load_meta_servers(after: float) -> Optional[tuple[float, dict]]:
+    if shard_db is None:
+        return None
+    row = shard_db.execute("SELECT fetched_at, payload FROM meta_servers WHERE fetched_at > ?", (after,)).fetchone()
+    return (row[0], json.loads(row[1])) if row else None
+
+
+def load_shared_snapshots() -> list[ServerSnapshot]:
+    """The latest snapshot of every server any shard polls"""
+    snapshots = []
+    for server_id, fetched_at, raw in shard_db.execute("SELECT server_id, fetched_at, payload FROM snapshots"):
+        payload = json.loads(raw)
+        snapshots.append(ServerSnapshot(
+            server_id, payload["admins"], payload["stats"], fetched_at, payload.get("fetch_started", 0.0)
+        ))
+    return snapshots
+
+
+# ===========================================================
+#                      ALERT RULES
+# ===========================================================
+
+STAT_NAMES = {"moderation": "Moderation", "progress": "In progress", "unresolved": "Unresolved"}
+
+
+def parse_rule(spec: str) -> AlertRule:
+    """
+    Parse a rule spec:
+      reports <login> >|< N    - reports held by an admin
+      online <level> >|< N     - online admins of a level
+      <stat> >|< N             - moderation / progress / unresolved
+      <stat> +N <minutes>m     - stat grew by N within the window
+    """
+    parts = spec.split()
+    
+    if len(parts) == 4 and parts[0] in ("reports", "online") and parts[2] in (">", "<"):
+        subject = parts[1].lstrip("Ll") if parts[0] == "online" else parts[1]
+        if parts[0] == "online" and not subject.isdigit():
+            raise ValueError("Level must be a number")
+        return AlertRule(parts[0], subject, parts[2], int(parts[3]))
+    
+    if len(parts) == 3 and parts[0] in STAT_NAMES and parts[1] in (">", "<"):
+        return AlertRule(parts[0], "", parts[1], int(parts[2]))
+    
+    if len(parts) == 3 and parts[0] in STAT_NAMES and parts[1].startswith("+") and parts[2].endswith("m"):
+        window = int(parts[2][:-1]) * 60
+        if not 0 < window <= MAX_RULE_WINDOW:
+            raise ValueError(f"Window must be 1-{MAX_RULE_WINDOW // 60} minutes")
+        return AlertRule(parts[0], "", "+", int(parts[1][1:]), window)
+    
+    raise ValueError("Unknown rule format")
+
+
+def describe_rule(rule: AlertRule) -> str:
+    if rule.metric == "reports":
+        return f"reports {rule.subject} {rule.op} {rule.threshold}"
+    if rule.metric == "online":
+        return f"online L{rule.subject} {rule.op} {rule.threshold}"
+    if rule.op == "+":
+        return f"{rule.metric} +{rule.threshold} in {rule.window // 60}m"
+    return f"{rule.metric} {rule.op} {rule.threshold}"
+
+
+def snapshot_metrics(snapshot: ServerSnapshot) -> dict[tuple[str, str], int]:
+    metrics = {(key, ""): snapshot.stats.get(key, 0) for key in STAT_NAMES}
+    online_by_level = {}
+    
+    for admin in snapshot.admins:
+        metrics[("reports", admin["login"])] = admin_report_count(admin)
+        if admin.get("online", 0) > 0:
+            lvl = str(admin.get("admin", 0))
+            online_by_level[lvl] = online_by_level.get(lvl, 0) + 1
+    
+    for lvl in ("1", "2", "3", "4"):
+        metrics[("online", lvl)] = online_by_level.get(lvl, 0)
+    return metrics
+
+
+def index_rules(user_id: int):
+    session = user_sessions[user_id]
+    index = rule_index.setdefault(session.server_id, {})
+    for rule in session.rules:
+        index.setdefault((rule.metric, rule.subject), []).append((user_id, rule))
+
+
+def unindex_rules(user_id: int):
+    for index in rule_index.values():
+        for key in list(index):
+            index[key] = [entry for entry in index[key] if entry[0] != user_id]
+            if not index[key]:
+                del index[key]
+
+
+def record_metric_history(server_id: str, metrics: dict, now: float):
+    """Keep a short change history of report stats for growth rules"""
+    history = metric_history.setdefault(server_id, {})
+    for key in STAT_NAMES:
+        values = history.setdefault((key, ""), deque())
+        value = metrics[(key, "")]
+        if not values or values[-1][1] != value:
+            values.append((now, value))
+        # The last change before the window is the value at its start
+        while len(values) > 1 and values[1][0] <= now - MAX_RULE_WINDOW:
+            values.popleft()
+
+
+def rule_holds(rule: AlertRule, server_id: str, value: int, now: float) -> bool:
+    if rule.op == ">":
+        return value > rule.threshold
+    if rule.op == "<":
+        return value < rule.threshold
+    
+    history = metric_history.get(server_id, {}).get((rule.metric, rule.subject), ())
+    lowest = value
+    # Values in the window, down to the one in effect when it started
+    for t, v in reversed(history):
+        lowest = min(lowest, v)
+        if t <= now - rule.window:
+            break
+    return value - lowest >= rule.threshold
+
+
+def check_rule(user_id: int, rule: AlertRule, server_id: str, value: int, now: float):
+    holds = rule_holds(rule, server_id, value, now)
+    if holds and not rule.active:
+        pending_alerts.setdefault(user_id, []).append(f"<b>Rule:</b> {html.escape(describe_rule(rule))} (now {value})")
+    rule.active = holds
+
+
+def evaluate_rules(server_id: str, previous: Optional[dict], metrics: dict, now: float):
+    """Evaluate only the rules whose metric changed since the previous snapshot"""
+    record_metric_history(server_id, metrics, now)
+    
+    for key, entries in rule_index.get(server_id, {}).items():
+        value = metrics.get(key, 0)
+        if previous is not None and previous.get(key, 0) == value:
+            continue
+        for user_id, rule in entries:
+            check_rule(user_id, rule, server_id, value, now)
+
+
+# ===========================================================
+#                      QUEUE RATES
+# ===========================================================
+
+def update_queue_rates(server_id: str, previous: Optional[dict], metrics: dict, now: float):
+    """Fold one snapshot's deltas into the server's sliding windows"""
+    if server_id not in queue_rates:
+        queue_rates[server_id] = QueueRates(started=now)
+    rates = queue_rates[server_id]
+    if previous is None:
+        return
+    
+    unresolved_diff = metrics[("unresolved", "")] - previous[("unresolved", "")]
+    rates.backlog.add(now, unresolved_diff)
+    if unresolved_diff > 0:
+        rates.new_reports.add(now, unresolved_diff)
+    elif unresolved_diff < 0:
+        rates.unresolved_dropped_at = now
+    
+    closed = 0
+    for key, value in metrics.items():
+        if key[0] != "reports":
+            continue
+        diff = previous.get(key, 0) - value
+        if diff > 0:
+            closed += diff
+            if key[1] not in rates.admin_closed:
+                rates.admin_closed[key[1]] = SlidingWindow(RATE_WINDOW)
+            rates.admin_closed[key[1]].add(now, diff)
+    if closed:
+        rates.closed.add(now, closed)
+    
+    check_backlog_growth(server_id, rates, now)
+
+
+def check_backlog_growth(server_id: str, rates: QueueRates, now: float):
+    rates.backlog.expire(now)
+    growth = rates.backlog.total
+    
+    if growth >= BACKLOG_GROWTH_ALERT and not rates.backlog_alert:
+        rates.backlog_alert = True
+        alert = f"<b>Backlog growing:</b> unresolved +{growth} in {RATE_WINDOW // 60}m"
+        log_alert(server_id, alert, now)
+        # Only running monitors drain pending_alerts; hibernated users would pile up stale ones
+        for user_id in monitor_tasks:
+            session = user_sessions.get(user_id)
+            if session and session.server_id == server_id and session.notifications:
+                pending_alerts.setdefault(user_id, []).append(alert)
+    elif growth < BACKLOG_GROWTH_ALERT // 2:
+        rates.backlog_alert = False
+
+
+# ===========================================================
+#                     SERVER STATUS
+# ===========================================================
+
+def update_server_status(server: dict, now: float) -> list[str]:
+    """Fold one /meta/servers entry into its ServerStatus, returning alerts"""
+    server_id = server["id"].lower()
+    online, tech_works = bool(server.get("status")), bool(server.get("techWorks"))
+    queue = server.get("queuedPlayers", 0)
+    
+    status = server_statuses.get(server_id)
+    if status is None:
+        server_statuses[server_id] = ServerStatus(
+            server["name"], online, tech_works, queue, now, queue_alert=queue >= QUEUE_ALERT_THRESHOLD
+        )
+        return []
+    
+    alerts = []
+    name = f"<b>{status.name}</b>"
+    if online != status.online:
+        alerts.append(f"{name} is back online" if online else f"{name} went offline")
+    if tech_works != status.tech_works:
+        alerts.append(f"{name} entered tech works" if tech_works else f"{name} finished tech works")
+    
+    minutes = (now - status.updated) / 60
+    if minutes > 0 and (queue or status.queue):
+        drained = (status.queue - queue) / minutes
+        status.drain_rate += DRAIN_SMOOTHING * (drained - status.drain_rate)
+    elif not queue:
+        status.drain_rate = 0.0
+    
+    if queue >= QUEUE_ALERT_THRESHOLD and not status.queue_alert:
+        status.queue_alert = True
+        alerts.append(f"{name} queue is {queue} ({drain_text(status.drain_rate, queue)})")
+    elif queue < QUEUE_ALERT_THRESHOLD // 2 and status.queue_alert:
+        status.queue_alert = False
+        alerts.append(f"{name} queue is back to {queue}")
+    
+    status.online, status.tech_works, status.queue, status.updated = online, tech_works, queue, now
+    return alerts
+
+
+def drain_text(rate: float, queue: int) -> str:
+    if rate <= 0:
+        return "not draining" if queue else "empty"
+    return f"draining {rate:.0f}/min, ~{format_time(int(queue / rate * 60))} to clear"
+
+
+async def fetch_meta_servers() -> Optional[dict]:
+    """/meta/servers through the first session the panel accepts"""
+    for session in list(user_sessions.values()):
+        try:
+            data = await api_get(session, "/meta/servers")
+        except Exception:
+            # Slow or failing panel: trying more sessions would only add load
+            return None
+        if data.get("status"):
+            return data
+    return None
+
+
+async def apply_meta_servers(now: float, data: dict):
+    global meta_servers
+    meta_servers = (now, data)
+    alerts = {}
+    for server in data.get("result", {}).get("servers", []):
+        server_alerts = update_server_status(server, now)
+        if server_alerts:
+            alerts[server["id"].lower()] = server_alerts
+            for alert in server_alerts:
+                log_alert(server["id"], alert, now)
+    if alerts:
+        await send_status_alerts(alerts)
+
+
+async def servers_poll_loop():
+    """
+    One /meta/servers request per interval for all users. Sharded, the shard
+    holding the lease fetches and the others read its result from the table.
+    """
+    request_priority.set(PRIORITY_MONITOR)
+    while True:
+        heartbeat()
+        if await shard_call(claim_server, "/meta/servers", SERVERS_POLL_INTERVAL * 3):
+            data = await fetch_meta_servers()
+            if data:
+                now = time.time()
+                await shard_call(publish_meta_servers, now, data)
+                await apply_meta_servers(now, data)
+            delay = SERVERS_POLL_INTERVAL
+        else:
+            shared = await shard_call(load_meta_servers, meta_servers[0] if meta_servers else 0.0)
+            if shared:
+                await apply_meta_servers(*shared)
+            delay = SHARED_SNAPSHOT_POLL
+        
+        await asyncio.sleep(delay)
+
+
+async def send_status_alerts(alerts: dict[str, list[str]]):
+    for user_id, session in list(user_sessions.items()):
+        notifications = [alert for server_id in session.status_alerts for alert in alerts.get(server_id, ())]
+        if notifications:
+            await send_notifications(user_id, notifications)
+
+
+def start_servers_poller():
+    supervise("servers", servers_poll_loop(), start_servers_poller, SERVERS_POLL_INTERVAL)
+
+
+def status_text(session: UserSession) -> str:
+    text = f"<b>Server status</b>\n{'='*20}\n\n"
+    if not server_statuses:
+        return text + "No data yet"
+    
+    for server_id, status in sorted(server_statuses.items(), key=lambda x: x[1].name):
+        mark = "+" if status.online else "-"
+        tech = " [TECH]" if status.tech_works else ""
+        queue = f", queue {status.queue} ({drain_text(status.drain_rate, status.queue)})" if status.queue else ""
+        subscribed = " *" if server_id in session.status_alerts else ""
+        text += f"{mark} <b>{status.name}</b>{queue}{tech}{subscribed}\n"
+    
+    return text + (
+        f"\n<i>* alerts on. Toggle with /status SERVER, e.g.</i> <code>/status {session.server_id.lower()}</code>"
+    )
+
+
+# ===========================================================
+#                     ONLINE TIMELINE
+# ===========================================================
+
+def update_timeline(snapshot: ServerSnapshot):
+    """Open and close admins' online intervals from one snapshot"""
+    timeline = timelines.setdefault(snapshot.server_id, {})
+    online = set()
+    
+    for admin in snapshot.admins:
+        seconds = admin.get("online", 0)
+        if seconds > 0:
+            online.add(admin["login"])
+            if admin["login"] not in timeline:
+                timeline[admin["login"]] = AdminTimeline()
+            # `online` is the current session's length, which dates the join
+            timeline[admin["login"]].open(snapshot.fetched_at - seconds)
+    
+    for login, admin_timeline in timeline.items():
+        if admin_timeline.online_since and login not in online:
+            admin_timeline.close(snapshot.fetched_at)
+
+
+def format_clock(moment: float) -> str:
+    return datetime.fromtimestamp(moment).strftime("%H:%M")
+
+
+def timeline_text(server_id: str, login: str) -> str:
+    """Profile section: today's sessions of one admin as seen by the bot"""
+    admin_timeline = timelines.get(server_id, {}).get(login)
+    if admin_timeline is None:
+        return ""
+    
+    now = time.time()
+    sessions = admin_timeline.sessions(start_of_day(now), now)
+    total = sum((end or now) - max(start, start_of_day(now)) for start, end in sessions)
+    text = f"\n<b>Sessions today:</b> {len(sessions)} ({format_time(int(total))})\n"
+    for start, end in sessions[-5:]:
+        text += f"  {format_clock(start)} - {format_clock(end) if end else 'now'}\n"
+    return text
+
+
+def who_text(server_id: str, moment: float) -> str:
+    snapshot = server_snapshots.get(server_id)
+    levels = {a["login"]: a.get("admin", 0) for a in snapshot.admins} if snapshot else {}
+    
+    online = sorted(
+        (login for login, admin_timeline in timelines.get(server_id, {}).items() if admin_timeline.online_at(moment)),
+        key=lambda login: (-levels.get(login, 0), login)
+    )
+    text = f"<b>Online at {datetime.fromtimestamp(moment).strftime('%d.%m %H:%M')}:</b> {len(online)}\n\n"
+    lines = [f"  {get_level_emoji(levels.get(login, 0))} {login}\n" for login in online]
+    return join_bounded([text], lines, [])
+
+
+# ===========================================================
+#                      DAILY DIGEST
+# ===========================================================
+
+def update_digest(server_id: str, previous: Optional[dict], metrics: dict, now: float):
+    if server_id not in daily_digests:
+        daily_digests[server_id] = DailyDigest(started=now)
+    digest = daily_digests[server_id]
+    
+    online = sum(metrics[("online", lvl)] for lvl in ("1", "2", "3", "4"))
+    if online > digest.peak_online:
+        digest.peak_online, digest.peak_at = online, now
+    
+    unresolved = metrics[("unresolved", "")]
+    digest.backlog_sum += unresolved
+    digest.backlog_max = max(digest.backlog_max, unresolved)
+    digest.samples += 1
+    
+    if previous is None:
+        return
+    digest.new_reports += max(0, unresolved - previous[("unresolved", "")])
+    for key, value in metrics.items():
+        if key[0] == "reports":
+            diff = previous.get(key, 0) - value
+            if diff > 0:
+                digest.handled[key[1]] = digest.handled.get(key[1], 0) + diff
+                digest.closed += diff
+
+
+def digest_text(server_id: str, digest: DailyDigest) -> str:
+    since = datetime.fromtimestamp(digest.started).strftime("%d.%m %H:%M")
+    text = (
+        f"<b>Daily digest</b> <code>{server_id}</code>\n"
+        f"<i>Since {since}</i>\n\n"
+        f"Peak online: <b>{digest.peak_online}</b>"
+    )
+    if digest.peak_at:
+        text += f" at {datetime.fromtimestamp(digest.peak_at).strftime('%H:%M')}"
+    text += (
+        f"\nUnresolved: avg <b>{digest.backlog_sum / max(digest.samples, 1):.1f}</b>, max {digest.backlog_max}\n"
+        f"New reports: <b>{digest.new_reports}</b>\n"
+        f"Handled: <b>{digest.closed}</b>\n"
+    )
+    
+    top = sorted(digest.handled.items(), key=lambda x: x[1], reverse=True)[:DIGEST_TOP_ADMINS]
+    if top:
+        text += "\n" + "\n".join(f"  {login}: <b>{count}</b>" for login, count in top)
+    return text
+
+
+def seconds_until_digest(now: datetime) -> float:
+    hour, minute = map(int, DIGEST_TIME.split(":"))
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    seconds = (target - now).total_seconds()
+    return seconds if seconds > 0 else seconds + 24 * 3600
+
+
+async def send_digests():
+    """Send each server's aggregates to its subscribers and start a new period"""
+    now = time.time()
+    for server_id, digest in list(daily_digests.items()):
+        daily_digests[server_id] = DailyDigest(started=now)
+        if not digest.samples:
+            continue
+        text = digest_text(server_id, digest)
+        for user_id, session in list(user_sessions.items()):
+            if session.digest and session.server_id == server_id:
+                await send_notifications(user_id, [text])
+
+
+async def digest_loop():
+    while True:
+        await asyncio.sleep(seconds_until_digest(datetime.now()))
+        await send_digests()
+
+
+def start_digest():
+    supervise("digest", digest_loop(), start_digest)
+
+
+# ===========================================================
+#                    MONITORING SYSTEM
+# ===========================================================
+
+def monitor_diff(state: MonitorState, watched: set, admins: list, stats: dict) -> list[str]:
+    """Notifications for one user between their last seen state and a snapshot, updating the state"""
+    notifications = []
+    
+    current_online = {a["login"] for a in admins if a.get("online", 0) > 0}
+    joined = current_online - state.online_admins
+    left = state.online_admins - current_online
+    
+    for login in joined:
+        admin = next((a for a in admins if a["login"] == login), None)
+        if login in watched:
+            notifications.insert(0, f"<b>Tracked admin {login} joined!</b>")
+        elif admin:
+            lvl = admin.get("admin", 0)
+            notifications.append(f"+ <b>{login}</b> joined ({get_level_name(lvl)})")
+    
+    for login in left:
+        if login in watched:
+            notifications.insert(0, f"<b>Tracked admin {login} left!</b>")
+        else:
+            notifications.append(f"- <b>{login}</b> left")
+    
+    state.online_admins = current_online
+    
+    if stats != state.reports_stats:
+        old, new = state.reports_stats, stats
+        changes = []
+        
+        for key, name in [("moderation", "Moderation"), ("progress", "In progress"), ("unresolved", "Unresolved")]:
+            if new.get(key, 0) != old.get(key, 0):
+                diff = new[key] - old.get(key, 0)
+                sign = "+" if diff > 0 else ""
+                changes.append(f"{name}: {old.get(key, 0)} -> {new[key]} ({sign}{diff})")
+        
+        if changes:
+            notifications.append("<b>Stats changed:</b>\n" + "\n".join(f"  {c}" for c in changes))
+        
+        state.reports_stats = stats.copy()
+    
+    for admin in admins:
+        login = admin["login"]
+        new_count = admin_report_count(admin)
+        old_count = state.admin_reports.get(login, 0)
+        
+        if new_count != old_count:
+            diff = new_count - old_count
+            if watched and login not in watched:
+                state.admin_reports[login] = new_count
+                continue
+            
+            if diff > 0:
+                notifications.append(f"<b>{login}</b> +{diff} report (total: {new_count})")
+            else:
+                notifications.append(f"<b>{login}</b> closed {abs(diff)} (left: {new_count})")
+        
+        state.admin_reports[login] = new_count
+    
+    return notifications
+
+
+async def monitor_loop(user_id: int):
+    seen = 0.0
+    previous_started = 0.0
+    while user_id in user_sessions:
+        session = user_sessions[user_id]
+        snapshot = await wait_snapshot(session.server_id, seen)
+        seen = snapshot.fetched_at
+        # Changes in this snapshot happened after the previous fetch started
+        changed_after, previous_started = previous_started, snapshot.fetch_started
+        
+        alerts = pending_alerts.pop(user_id, [])
+        if not session.notifications:
+            continue
+            
+        try:
+            admins = snapshot.admins
+            stats = snapshot.stats
+            
+            if user_id not in monitor_states:
+                monitor_states[user_id] = MonitorState()
+                monitor_states[user_id].online_admins = {a["login"] for a in admins if a.get("online", 0) > 0}
+                monitor_states[user_id].reports_stats = stats.copy()
+                monitor_states[user_id].admin_reports = {a["login"]: admin_report_count(a) for a in admins}
+                if alerts:
+                    await send_notifications(user_id, alerts)
+                continue
+            
+            state = monitor_states[user_id]
+            notifications = monitor_diff(state, set(session.watchlist), admins, stats)
+            
+            notifications = alerts + notifications
+            if notifications:
+                await send_notifications(user_id, notifications, snapshot, changed_after)
+                    
+        except Exception:
+            pass
+
+
+async def send_notifications(
+    user_id: int, notifications: list[str],
+    snapshot: Optional[ServerSnapshot] = None, changed_after: float = 0.0
+):
+    window = DEGRADATION_LEVELS[governor_level][2]
+    if window or user_id in coalesced:
+        # Under load, batch a user's notifications into one message per window
+        if user_id not in coalesced:
+            coalesced[user_id] = []
+            spawn_background(flush_coalesced(user_id, window))
+        coalesced[user_id].extend(notifications)
+        return
+    await deliver_notifications(user_id, notifications, snapshot, changed_after)
+
+
+async def deliver_notifications(
+    user_id: int, notifications: list[str],
+    snapshot: Optional[ServerSnapshot] = None, changed_after: float = 0.0
+):
+    text = join_bounded(["<b>Notifications</b>"], [f"\n\n{n}" for n in notifications], [])
+    session = user_sessions.get(user_id)
+    record = {
+        "server_id": session.server_id if session else "", "at": time.time(), "type": "delivery",
+        "user": user_id, "count": len(notifications), "ok": True,
+    }
+    try:
+        await bot.send_message(user_id, text, parse_mode="HTML")
+    except Exception as e:
+        log_buffer.append({**record, "ok": False, "error": repr(e)})
+        return
+    log_buffer.append(record)
+    
+    if snapshot is not None:
+        sent_at = time.time()
+        record_latency(snapshot.server_id, "delivery", sent_at - snapshot.fetched_at)
+        if changed_after and snapshot.fetch_started:
+            # The change happened somewhere between the two fetch starts
+            changed_at = (changed_after + snapshot.fetch_started) / 2
+            record_latency(snapshot.server_id, "end_to_end", sent_at - changed_at)
+
+
+async def flush_coalesced(user_id: int, window: float):
+    await asyncio.sleep(window)
+    notifications = coalesced.pop(user_id, [])
+    if notifications:
+        await deliver_notifications(user_id, notifications)
+
+
+# ===========================================================
+#                    NOTIFICATION LOG
+# ===========================================================
+
+def log_path() -> str:
+    return shard_path(NOTIFICATION_LOG_PATH)
+
+
+def log_alert(server_id: str, text: str, now: float):
+    log_buffer.append({"server_id": server_id, "at": now, "type": "alert", "text": text})
+
+
+def flush_log():
+    """Append buffered records in one write and index them"""
+    if not log_buffer:
+        return
+    lines = [(json.dumps(record) + "\n").encode() for record in log_buffer]
+    try:
+        with open(log_path(), "ab") as f:
+            f.write(b"".join(lines))
+    except OSError as e:
+        print(f"  ! Notification log write failed: {e}")
+        return
+    
+    for record, line in zip(log_buffer, lines):
+        log_index.add(record, log_index.size)
+        log_index.size += len(line)
+    log_buffer.clear()
+    
+    if log_index.size > LOG_MAX_BYTES:
+        try:
+            rotate_log()
+        except OSError as e:
+            print(f"  ! Notification log rotation failed: {e}")
+
+
+def rotate_log():
+    """Move the log to ".1" and start a new one, keeping record numbers and delivery counts"""
+    global log_index
+    path = log_path()
+    os.replace(path, f"{path}.1")
+    log_index = LogIndex(
+        first=log_index.first + len(log_index.offsets), sent=log_index.sent, failed=log_index.failed
+    )
+
+
+def load_log():
+    """Index the existing log once at startup, rotating it if it grew too big"""
+    global log_index
+    try:
+        if os.path.getsize(log_path()) > LOG_MAX_BYTES:
+            rotate_log()
+    except OSError:
+        pass
+    
+    path = log_path()
+    
+    log_index = LogIndex()
+    try:
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    log_index.add(json.loads(line), log_index.size)
+                except (ValueError, KeyError):
+                    pass
+                log_index.size += len(line)
+    except OSError:
+        pass
+
+
+def read_log_records(numbers: list[int]) -> list[dict]:
+    records = []
+    with open(log_path(), "rb") as f:
+        for number in numbers:
+            f.seek(log_index.offsets[number])
+            records.append(json.loads(f.readline()))
+    return records
+
+
+async def log_flush_loop():
+    while True:
+        heartbeat()
+        await asyncio.sleep(LOG_FLUSH_INTERVAL)
+        flush_log()
+
+
+def start_log():
+    load_log()
+    supervise("log", log_flush_loop(), start_log, LOG_FLUSH_INTERVAL)
+
+
+def describe_log_record(record: dict) -> str:
+    kind, login = record["type"], record.get("login", "")
+    if kind == "joined":
+        return f"+ <b>{login}</b> joined ({get_level_name(record['level'])})"
+    if kind == "left":
+        return f"- <b>{login}</b> left"
+    if kind == "stats":
+        return f"{STAT_NAMES.get(record['key'], record['key'])}: {record['old']} -> {record['new']}"
+    if kind == "reports":
+        diff = record["new"] - record["old"]
+        if diff > 0:
+            return f"<b>{login}</b> +{diff} report (total: {record['new']})"
+        return f"<b>{login}</b> closed {-diff} (left: {record['new']})"
+    return record.get("text", kind)
+
+
+def parse_log_cursor(value: str) -> float:
+    """The cursor as an exclusive upper bound, so the whole named second (or minute) is included"""
+    moment, precision = parse_moment(value)
+    return moment + precision
+
+
+def log_text(server_id: str, login: str, before: Optional[float], older_than: Optional[int] = None) -> str:
+    """
+    Page of events before the time `before`, or before record number
+    `older_than` (the "Older" cursor), newest first, found through the index
+    """
+    server_id = server_id.lower()
+    if login:
+        numbers = log_index.by_login.get((server_id, login.lower()), [])
+    else:
+        numbers = log_index.by_server.get(server_id, [])
+    
+    if older_than is not None:
+        end = bisect_left(numbers, older_than - log_index.first)
+    elif before:
+        end = bisect_left(numbers, before, key=lambda n: log_index.times[n])
+    else:
+        end = len(numbers)
+    page = numbers[max(0, end - LOG_PAGE):end]
+    
+    title = f"<b>Log</b> <code>{server_id}</code>" + (f" <b>{html.escape(login)}</b>" if login else "")
+    header = [f"{title}\n{'='*20}\n\n"]
+    if not page:
+        return header[0] + "No events"
+    
+    records = read_log_records(page)
+    lines = [
+        f"<code>{datetime.fromtimestamp(r['at']).strftime('%d.%m %H:%M:%S')}</code> {describe_log_record(r)}\n"
+        for r in reversed(records)
+    ]
+    footer = []
+    if end > len(page):
+        # Records of one snapshot share a timestamp, so page by record number
+        cursor = f"#{log_index.first + page[0]}"
+        footer.append(f"\n<i>Older:</i> <code>/log {html.escape(login)} {cursor}</code>".replace("  ", " "))
+    return join_bounded(header, lines, footer)
+
+
+# ===========================================================
+#                    LATENCY TRACKING
+# ===========================================================
+
+LATENCY_METRICS = (("fetch", "Fetch"), ("delivery", "Detect -> sent"), ("end_to_end", "Change -> sent"))
+
+
+def record_latency(server_id: str, metric: str, seconds: float):
+    by_metric = latency_samples.setdefault(server_id, {})
+    if metric not in by_metric:
+        by_metric[metric] = deque(maxlen=LATENCY_SAMPLES)
+    by_metric[metric].append(seconds)
+
+
+def latency_report() -> str:
+    text = f"<b>Latency</b> (seconds)\n{'='*20}\n"
+    if not latency_samples:
+        return text + "\nNo samples yet"
+    
+    for server_id in sorted(latency_samples):
+        text += f"\n<b>{server_id}</b>\n"
+        for metric, name in LATENCY_METRICS:
+            values = sorted(latency_samples[server_id].get(metric, ()))
+            if not values:
+                continue
+            text += (
+                f"  {name}: p50 {percentile(values, 0.5):.2f} "
+                f"p90 {percentile(values, 0.9):.2f} "
+                f"p99 {percentile(values, 0.99):.2f} (n={len(values)})\n"
+            )
+    return text
+
+
+def start_monitor(user_id: int, delay: float = 0.0):
+    if user_id in monitor_tasks:
+        monitor_tasks[user_id].cancel()
+    # Waits on snapshots, so a stalled poller is what gets flagged as stuck
+    monitor_tasks[user_id] = supervise(f"monitor:{user_id}", monitor_loop(user_id), lambda: start_monitor(user_id))
+    unindex_rules(user_id)
+    index_rules(user_id)
+    ensure_server_poller(user_sessions[user_id].server_id, delay)
+
+
+def stop_monitor(user_id: int):
+    unsupervise(f"monitor:{user_id}")
+    if user_id in monitor_tasks:
+        monitor_tasks[user_id].cancel()
+        del monitor_tasks[user_id]
+    if user_id in monitor_states:
+        del monitor_states[user_id]
+    unindex_rules(user_id)
+    pending_alerts.pop(user_id, None)
+
+
+# ===========================================================
+#                    OVERLOAD GOVERNOR
+# ===========================================================
+
+def refresh_stretch() -> float:
+    return DEGRADATION_LEVELS[governor_level][0]
+
+
+def view_paused(user_id: int) -> bool:
+    """Degraded mode skips refreshes of views nobody has touched recently"""
+    if not DEGRADATION_LEVELS[governor_level][1]:
+        return False
+    return time.monotonic() - last_activity.get(user_id, 0.0) > IDLE_VIEW_PAUSE
+
+
+def governor_pressure() -> float:
+    """Worst signal relative to its target; above 1 means overloaded"""
+    now = time.monotonic()
+    recent = [(elapsed, ok) for started, elapsed, ok in upstream_outcomes if started > now - GOVERNOR_WINDOW]
+    latencies = sorted(elapsed for elapsed, ok in recent if ok)
+    
+    lag_samples = list(loop_lag)[-int(GOVERNOR_INTERVAL / LAG_PROBE_INTERVAL):]
+    governor_signals.update(
+        p95=percentile(latencies, 0.95),
+        errors=sum(1 for _, ok in recent if not ok) / len(recent) if recent else 0.0,
+        lag=max(lag_samples, default=0.0),
+        queue=sum(budget.queued() for budget in upstream_budgets.values()),
+    )
+    return max(
+        governor_signals["p95"] / GOVERNOR_P95,
+        governor_signals["errors"] / GOVERNOR_ERROR_RATE,
+        governor_signals["lag"] / GOVERNOR_LAG,
+        governor_signals["queue"] / GOVERNOR_QUEUE,
+    )
+
+
+def update_governor():
+    global governor_level, governor_calm
+    pressure = governor_pressure()
+    previous = governor_level
+    
+    if pressure > 1:
+        governor_calm = 0
+        governor_level = min(governor_level + 1, len(DEGRADATION_LEVELS) - 1)
+    elif pressure < 0.5 and governor_level:
+        governor_calm += 1
+        if governor_calm >= GOVERNOR_RECOVERY:
+            governor_calm = 0
+            governor_level -= 1
+    else:
+        governor_calm = 0
+    
+    if governor_level != previous:
+        signals = ", ".join(f"{name} {value:.2f}" for name, value in governor_signals.items())
+        notify_owners(f"  ! Degradation level {previous} -> {governor_level} ({signals})")
+
+
+async def governor_loop():
+    while True:
+        heartbeat()
+        await asyncio.sleep(GOVERNOR_INTERVAL)
+        update_governor()
+
+
+def start_governor():
+    supervise("governor", governor_loop(), start_governor, GOVERNOR_INTERVAL)
+
+
+# ===========================================================
+#                   MEMORY INTROSPECTION
+# ===========================================================
+
+def deep_sizeof(obj, seen: set) -> int:
+    """Approximate retained size of an object graph, counting shared objects once"""
+    if id(obj) in seen or isinstance(obj, (type, asyncio.Task, asyncio.AbstractEventLoop)):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+def memory_structures() -> dict:
+    return {
+        "user_sessions": user_sessions,
+        "monitor_states": monitor_states,
+        "live_messages": live_messages,
+        "server_snapshots": server_snapshots,
+        "server_metrics": server_metrics,
+        "metric_history": metric_history,
+        "rule_index": rule_index,
+        "queue_rates": queue_rates,
+        "daily_digests": daily_digests,
+        "timelines": timelines,
+        "latency_samples": latency_samples,
+        "response_cache": response_cache,
+        "prefetched": prefetched,
+        "dashboards": dashboards,
+        "pending_alerts": pending_alerts,
+        "last_activity": last_activity,
+        "update_locks": update_locks,
+        "fsm_storage": dp.storage.storage,
+    }
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return f"{size:.0f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+
+def memory_report() -> str:
+    global memory_snapshot
+    
+    sizes = {}
+    text = f"<b>Memory</b>\n{'='*20}\n\n"
+    for name, obj in memory_structures().items():
+        sizes[name] = deep_sizeof(obj, set())
+        text += f"{name}: {len(obj)} items, {format_bytes(sizes[name])}\n"
+    
+    text += (
+        f"\ntasks: monitor {len(monitor_tasks)}, refresh {len(refresh_tasks)}, "
+        f"pollers {len(server_pollers)}, dashboards {len(dashboard_tasks)}, background {len(background_tasks)}\n"
+    )
+    
+    if memory_history:
+        first_at, first = memory_history[0]
+        last_at, last = memory_history[-1]
+        total = sum(sizes.values())
+        text += (
+            f"\n<b>Growth</b>\n"
+            f"  since last ({format_time(int(time.time() - last_at))} ago): "
+            f"{format_bytes(total - sum(last.values()))}\n"
+            f"  since first ({format_time(int(time.time() - first_at))} ago): "
+            f"{format_bytes(total - sum(first.values()))}\n"
+        )
+        grown = sorted(sizes, key=lambda name: sizes[name] - last.get(name, 0), reverse=True)[:3]
+        text += "  top: " + ", ".join(f"{n} {format_bytes(sizes[n] - last.get(n, 0))}" for n in grown) + "\n"
+    memory_history.append((time.time(), sizes))
+    
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        memory_snapshot = tracemalloc.take_snapshot()
+        return text + "\n<i>tracemalloc started, run /memory again for allocation sites and /memory stop when done</i>"
+    
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    text += "\n<b>Top allocation growth</b>\n"
+    for stat in snapshot.compare_to(memory_snapshot, "lineno")[:MEMORY_TOP_SITES]:
+        frame = stat.traceback[0]
+        text += (
+            f"  <code>{html.escape(os.path.basename(frame.filename))}:{frame.lineno}</code> "
+            f"{format_bytes(stat.size_diff)} ({stat.count_diff:+d})\n"
+        )
+    memory_snapshot = snapshot
+    return text + "\n<i>Tracing every allocation, /memory stop to end it</i>"
+
+
+def stop_memory_trace() -> str:
+    global memory_snapshot
+    if not tracemalloc.is_tracing():
+        return "tracemalloc is not running"
+    tracemalloc.stop()
+    memory_snapshot = None
+    return "tracemalloc stopped"
+
+
+# ===========================================================
+#                       HIBERNATION
+# ===========================================================
+
+def touch_user(user_id: int):
+    """Record activity and wake a hibernated user's monitoring"""
+    last_activity[user_id] = time.monotonic()
+    if user_id in hibernated:
+        hibernated.discard(user_id)
+        if user_id in user_sessions and user_id not in monitor_tasks:
+            start_monitor(user_id)
+
+
+def hibernate_idle_users():
+    now = time.monotonic()
+    for user_id in list(user_sessions):
+        idle = now - last_activity.setdefault(user_id, now)
+        
+        if idle > LIVE_IDLE_TIMEOUT and (user_id in refresh_tasks or user_id in live_messages):
+            stop_auto_refresh(user_id)
+        
+        if idle > MONITOR_IDLE_TIMEOUT and user_id not in hibernated:
+            stop_monitor(user_id)
+            hibernated.add(user_id)
+    
+    for user_id in list(last_activity):
+        if user_id not in user_sessions:
+            del last_activity[user_id]
+            hibernated.discard(user_id)
+
+
+async def hibernation_loop():
+    while True:
+        heartbeat()
+        await asyncio.sleep(HIBERNATION_CHECK_INTERVAL)
+        hibernate_idle_users()
+
+
+def start_hibernation():
+    supervise("hibernation", hibernation_loop(), start_hibernation, HIBERNATION_CHECK_INTERVAL)
+
+
+# ===========================================================
+#                       SUPERVISOR
+# ===========================================================
+
+def supervise(name: str, coro, restart: Callable[[], None], interval: float = 0.0) -> asyncio.Task:
+    """
+    Start a long-lived task under the supervisor. `restart` starts a fresh
+    one if it crashes, or if `interval` is set and the task stops calling
+    heartbeat() for STUCK_INTERVALS intervals. Restarting keeps the failure
+    count, so repeated crashes back off exponentially.
+    """
+    task = spawn_background(coro)
+    task.set_name(name)
+    now = time.monotonic()
+    
+    entry = supervised.get(name)
+    if entry is None:
+        supervised[name] = SupervisedTask(name, task, restart, interval, now, now)
+    else:
+        entry.task, entry.restart, entry.interval = task, restart, interval
+        entry.started = entry.last_tick = now
+        entry.restart_at = 0.0
+    return task
+
+
+def unsupervise(name: str):
+    supervised.pop(name, None)
+
+
+def heartbeat():
+    """Mark the current supervised task as alive"""
+    task = asyncio.current_task()
+    entry = supervised.get(task.get_name())
+    if entry is not None and entry.task is task:
+        entry.last_tick = time.monotonic()
+
+
+def notify_owners(text: str):
+    print(text)
+    for owner_id in OWNER_IDS:
+        spawn_background(send_owner_alert(owner_id, text))
+
+
+async def send_owner_alert(owner_id: int, text: str):
+    try:
+        await bot.send_message(owner_id, text.strip())
+    except Exception:
+        pass
+
+
+def schedule_restart(entry: SupervisedTask, reason: str, now: float):
+    delay = min(RESTART_BACKOFF_BASE * 2 ** entry.failures, RESTART_BACKOFF_MAX)
+    entry.failures += 1
+    entry.restart_at = now + delay
+    entry.error = reason
+    notify_owners(f"  ! Task {entry.name} {reason}, restart #{entry.failures} in {delay}s")
+
+
+def check_supervised():
+    now = time.monotonic()
+    for name, entry in list(supervised.items()):
+        task = entry.task
+        
+        if entry.restart_at:
+            if now >= entry.restart_at:
+                task.cancel()
+                try:
+                    entry.restart()
+                except Exception as e:
+                    supervised.pop(name, None)
+                    notify_owners(f"  ! Task {name} could not be restarted: {e!r}")
+            continue
+        
+        if task.done():
+            if task.cancelled() or task.exception() is None:
+                # Stopped on purpose or finished its work
+                if supervised.get(name) is entry:
+                    del supervised[name]
+            else:
+                schedule_restart(entry, f"crashed: {task.exception()!r}", now)
+        # Degraded mode stretches poll intervals, so it stretches the limit too
+        elif entry.interval and now - entry.last_tick > entry.interval * refresh_stretch() * STUCK_INTERVALS:
+            schedule_restart(entry, f"stuck for {now - entry.last_tick:.0f}s", now)
+        elif entry.failures and now - entry.started > RESTART_BACKOFF_MAX:
+            entry.failures = 0
+
+
+async def supervisor_loop():
+    while True:
+        await asyncio.sleep(SUPERVISOR_INTERVAL)
+        try:
+            check_supervised()
+        except Exception as e:
+            print(f"  ! Supervisor check failed: {e!r}")
+
+
+async def loop_lag_loop():
+    """Measure how late the event loop wakes us up, alerting owners on saturation"""
+    global loop_lag_alert
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + LAG_PROBE_INTERVAL
+        await asyncio.sleep(LAG_PROBE_INTERVAL)
+        lag = max(0.0, loop.time() - expected)
+        loop_lag.append(lag)
+        
+        if lag >= LOOP_LAG_ALERT and not loop_lag_alert:
+            loop_lag_alert = True
+            notify_owners(f"  ! Event loop lag {lag:.2f}s")
+        elif loop_lag_alert and max(list(loop_lag)[-10:]) < LOOP_LAG_ALERT / 2:
+            loop_lag_alert = False
+            notify_owners(f"  - Event loop lag back to {lag:.2f}s")
+
+
+def start_supervisor():
+    spawn_background(supervisor_loop())
+    spawn_background(loop_lag_loop())
+
+
+def health_report() -> str:
+    text = f"<b>Health</b>\n{'='*20}\n\n"
+    
+    text += f"Degradation level: <b>{governor_level}</b>"
+    if governor_signals:
+        text += " (" + ", ".join(f"{name} {value:.2f}" for name, value in governor_signals.items()) + ")"
+    text += "\n"
+    
+    values = sorted(loop_lag)
+    if values:
+        text += (
+            f"Loop lag: now {loop_lag[-1]:.3f}s, p50 {percentile(values, 0.5):.3f}s, "
+            f"p99 {percentile(values, 0.99):.3f}s, max {values[-1]:.3f}s\n"
+        )
+    
+    kinds: dict[str, int] = {}
+    for name in supervised:
+        kind = name.split(":", 1)[0]
+        kinds[kind] = kinds.get(kind, 0) + 1
+    text += "Tasks: " + (", ".join(f"{kind} {count}" for kind, count in sorted(kinds.items())) or "none") + "\n"
+    
+    now = time.monotonic()
+    failing = [entry for entry in supervised.values() if entry.failures]
+    if failing:
+        text += "\n<b>Restarting</b>\n"
+        for entry in failing[:10]:
+            state = f"in {entry.restart_at - now:.0f}s" if entry.restart_at else "running"
+            text += f"  {html.escape(entry.name)}: {entry.failures}x, {state}, {html.escape(entry.error)}\n"
+    
+    if prefetch_hits + prefetch_misses:
+        text += f"Prefetch: {prefetch_hits} hits, {prefetch_misses} misses\n"
+    
+    deliveries = log_index.sent + log_index.failed
+    if deliveries:
+        text += f"\nNotifications: {log_index.sent} sent, {log_index.failed} failed ({log_index.failed / deliveries:.1%} loss)\n"
+    
+    depths = sorted(update_depth_samples)
+    text += (
+        f"\nUpdates: {inflight_updates} in flight, {len(update_depth)} users queued, "
+        f"max depth now {max(update_depth.values(), default=0)}"
+    )
+    if depths:
+        text += f", p99 {percentile(depths, 0.99)}, max {depths[-1]}"
+    return text + "\n"
+
+
+# ===========================================================
+#                    SESSION STORAGE
+# ===========================================================
+
+def shard_path(path: str) -> str:
+    if shard_db is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{shard_id}{ext}"
+
+
+def sessions_path() -> str:
+    return shard_path(SESSIONS_PATH)
+
+
+def save_sessions():
+    path = sessions_path()
+    data = {str(user_id): asdict(session) for user_id, session in user_sessions.items()}
+    tmp = f"{path}.tmp"
+    # Holds panel session cookies, so only the bot's user may read it
+    with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.chmod(tmp, 0o600)
+    os.replace(tmp, path)
+
+
+def load_sessions() -> dict[int, UserSession]:
+    try:
+        with open(sessions_path(), encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    sessions = {}
+    for user_id, fields in data.items():
+        tracked = fields.pop("tracked_admin", "")
+        rules = [AlertRule(**{k: v for k, v in rule.items() if k != "active"}) for rule in fields.pop("rules", [])]
+        session = UserSession(**fields, rules=rules)
+        if tracked and tracked not in session.watchlist:
+            session.watchlist.append(tracked)
+        sessions[int(user_id)] = session
+    return sessions
+
+
+async def restore_sessions():
+    """Restore saved sessions, spreading each server's first poll over one interval"""
+    restored = {uid: s for uid, s in load_sessions().items() if uid not in user_sessions}
+    servers = sorted({s.server_id for s in restored.values()})
+    delays = {server: MONITOR_INTERVAL * i / len(servers) for i, server in enumerate(servers)}
+    
+    for user_id, session in restored.items():
+        user_sessions[user_id] = session
+        start_monitor(user_id, delays[session.server_id])
+    
+    print(f"  - Restored {len(restored)} sessions on {len(servers)} servers")
+
+
+# ===========================================================
+#                      BOT COMMANDS
+# ===========================================================
+
+@router.message(Command("start"))
+async def cmd_start(message: Message, state: FSMContext):
+    await state.clear()
+    user_id = message.from_user.id
+    stop_auto_refresh(user_id)
+    
+    if user_id in user_sessions:
+        session = user_sessions[user_id]
+        await message.answer(
+            f"<b>MAJESTIC MONITOR</b>\n\n"
+            f"Account: <b>{session.login}</b>\n"
+            f"Server: <code>{session.server_id}</code>\n"
+            f"{get_level_name(session.admin_level)}\n\n"
+            f"Select action:",
+            parse_mode="HTML",
+            reply_markup=kb_main()
+        )
+    else:
+        await message.answer(
+            f"<b>MAJESTIC MONITOR</b>\n\n"
+            f"Bot for monitoring admin panel\n"
+            f"majestic-files.net\n\n"
+            f"Features:\n"
+            f"  - Real-time notifications\n"
+            f"  - Auto-refresh statistics\n"
+            f"  - Admin list with pagination",
+            parse_mode="HTML",
+            reply_markup=kb_guest()
+        )
+
+
+@router.message(Command("menu"))
+async def cmd_menu(message: Message):
+    user_id = message.from_user.id
+    stop_auto_refresh(user_id)
+    
+    if user_id not in user_sessions:
+        return await message.answer("Please login first", reply_markup=kb_guest())
+    
+    session = user_sessions[user_id]
+    await message.answer(menu_text(session), parse_mode="HTML", reply_markup=kb_main())
+
+
+@router.message(Command("dashboard"))
+async def cmd_dashboard(message: Message):
+    """
+    /dashboard <view> [chat_id] - post a live view into this chat (or chat_id)
+    /dashboard stop [view] [chat_id] - stop dashboards in the chat
+    """
+    user_id = message.from_user.id
+    if user_id not in user_sessions:
+        return await message.answer("Login in a private chat with the bot first")
+    
+    args = message.text.split()[1:]
+    stopping = bool(args) and args[0] == "stop"
+    if stopping:
+        args = args[1:]
+    
+    chat_id = message.chat.id
+    if args and args[-1].lstrip("-").isdigit():
+        chat_id = int(args.pop())
+        if not await can_post_dashboard(chat_id, user_id):
+            return await message.answer("You must be an admin of that chat")
+    
+    views = [a for a in args if a in DASHBOARD_VIEWS]
+    if stopping:
+        refused = False
+        for key, dashboard in list(dashboards.items()):
+            if key[0] == chat_id and (not views or key[1] in views):
+                if await can_manage_dashboard(dashboard, user_id):
+                    stop_dashboard(key)
+                else:
+                    refused = True
+        if refused:
+            return await message.answer("Only its owner or a chat admin can stop a dashboard")
+        return await message.answer("Dashboard stopped")
+    
+    if len(views) != 1:
+        return await message.answer(f"Usage: /dashboard <{'|'.join(DASHBOARD_VIEWS)}> [chat_id]")
+    
+    session = user_sessions[user_id]
+    view_type = views[0]
+    current = dashboards.get((chat_id, view_type))
+    if current and not await can_manage_dashboard(current, user_id):
+        return await message.answer("Only its owner or a chat admin can replace this dashboard")
+    try:
+        text, _ = await render_view(session, LiveMessage(chat_id, 0, view_type))
+        posted = await bot.send_message(chat_id, text, parse_mode="HTML")
+    except Exception as e:
+        return await message.answer(f"<b>Error</b>\n\n{e}", parse_mode="HTML")
+    
+    start_dashboard(Dashboard(chat_id, posted.message_id, view_type, user_id))
+    if chat_id != message.chat.id:
+        await message.answer(f"Dashboard <b>{view_type}</b> posted", parse_mode="HTML")
+
+
+@router.message(Command("digest"))
+async def cmd_digest(message: Message):
+    user_id = message.from_user.id
+    if user_id not in user_sessions:
+        return await message.answer("Please login first", reply_markup=kb_guest())
+    
+    server_id = user_sessions[user_id].server_id
+    digest = daily_digests.get(server_id)
+    if digest is None or not digest.samples:
+        return await message.answer("No data yet, the digest is collected while monitoring is on")
+    await message.answer(digest_text(server_id, digest), parse_mode="HTML")
+
+
+@router.message(Command("memory"))
+async def cmd_memory(message: Message):
+    if message.from_user.id not in OWNER_IDS:
+        return
+    if message.text.split()[1:2] == ["stop"]:
+        return await message.answer(stop_memory_trace())
+    await message.answer(memory_report(), parse_mode="HTML")
+
+
+@router.message(Command("health"))
+async def cmd_health(message: Message):
+    if message.from_user.id not in OWNER_IDS:
+        return
+    await message.answer(health_report(), parse_mode="HTML")
+
+
+@router.message(Command("latency"))
+async def cmd_latency(message: Message):
+    if message.from_user.id not in OWNER_IDS:
+        return
+    await message.answer(latency_report(), parse_mode="HTML")
+
+
+@router.message(Command("rule"))
+async def cmd_rule(message: Message):
+    user_id = message.from_user.id
+    if user_id not in user_sessions:
+        return await message.answer("Please login first", reply_markup=kb_guest())
+    
+    session = user_sessions[user_id]
+    spec = message.text.partition(" ")[2].strip()
+    if not spec:
+        return await message.answer(rules_text(session), parse_mode="HTML", reply_markup=kb_rules(session))
+    
+    try:
+        rule = parse_rule(spec)
+    except ValueError as e:
+        return await message.answer(f"<b>Invalid rule</b>\n\n{e}\n\n{rules_text(session)}", parse_mode="HTML")
+    
+    metrics = server_metrics.get(session.server_id)
+    if metrics is not None:
+        rule.active = rule_holds(rule, session.server_id, metrics.get((rule.metric, rule.subject), 0), time.time())
+    
+    session.rules.append(rule)
+    unindex_rules(user_id)
+    index_rules(user_id)
+    save_sessions()
+    
+    state = " (already true)" if rule.active else ""
+    await message.answer(f"Rule added: <b>{html.escape(describe_rule(rule))}</b>{state}", parse_mode="HTML")
+
+
+@router.message(Command("who"))
+async def cmd_who(message: Message):
+    user_id = message.from_user.id
+    if user_id not in user_sessions:
+        return await message.answer("Please login first", reply_markup=kb_guest())
+    
+    value = message.text.partition(" ")[2].strip()
+    try:
+        moment, _ = parse_moment(value) if value else (time.time(), 0)
+    except ValueError as e:
+        return await message.answer(f"{e}\n\nUsage: /who HH:MM")
+    
+    server_id = user_sessions[user_id].server_id
+    if server_id not in timelines:
+        return await message.answer("No data yet, the timeline is collected while monitoring is on")
+    await message.answer(who_text(server_id, moment), parse_mode="HTML")
+
+
+@router.message(Command("log"))
+async def cmd_log(message: Message):
+    user_id = message.from_user.id
+    if user_id not in user_sessions:
+        return await message.answer("Please login first", reply_markup=kb_guest())
+    
+    args = message.text.split()[1:]
+    login = next((arg for arg in args if ":" not in arg and not arg.startswith("#")), "")
+    cursor = next((arg for arg in args if ":" in arg), "")
+    older = next((arg[1:] for arg in args if arg.startswith("#")), "")
+    try:
+        before = parse_log_cursor(cursor) if cursor else None
+        older_than = int(older) if older else None
+    except ValueError as e:
+        return await message.answer(f"{e}\n\nUsage: /log [LOGIN] [HH:MM]")
+    
+    flush_log()
+    server_id = user_sessions[user_id].server_id
+    await message.answer(log_text(server_id, login, before, older_than), parse_mode="HTML")
+
+
+@router.message(Command("status"))
+async def cmd_status(message: Message):
+    user_id = message.from_user.id
+    if user_id not in user_sessions:
+        return await message.answer("Please login first", reply_markup=kb_guest())
+    
+    session = user_sessions[user_id]
+    server_id = message.text.partition(" ")[2].strip().lower()
+    if server_id:
+        if server_id in session.status_alerts:
+            session.status_alerts.remove(server_id)
+        elif server_id in server_statuses:
+            session.status_alerts.append(server_id)
+        else:
+            return await message.answer(f"Unknown server <code>{html.escape(server_id)}</code>", parse_mode="HTML")
+        save_sessions()
+    
+    await message.answer(status_text(session), parse_mode="HTML")
+
+
+@router.message(Command("rules"))
+async def cmd_rules(message: Message):
+    user_id = message.from_user.id
+    if user_id not in user_sessions:
+        return await message.answer("Please login first", reply_markup=kb_guest())
+    
+    session = user_sessions[user_id]
+    await message.answer(rules_text(session), parse_mode="HTML", reply_markup=kb_rules(session))
+
+
+# ===========================================================
+#                    CALLBACK HANDLERS
+# ===========================================================
+
+@router.callback_query()
+async def dispatch_callback(callback: CallbackQuery, state: FSMContext):
+    """Decode callback data once and dispatch to its registered handler"""
+    user_id = callback.from_user.id
+    decoded = decode_callback(callback.data)
+    
+    if decoded is None:
+        await callback.answer("This menu is outdated")
+        if user_id in user_sessions:
+            return await callback.message.edit_text(menu_text(user_sessions[user_id]), parse_mode="HTML", reply_markup=kb_main())
+        return await callback.message.edit_text("Please login", reply_markup=kb_guest())
+    
+    action, args = decoded
+    kwargs = {}
+    if "state" in action.params:
+        kwargs["state"] = state
+    if "session" in action.params:
+        if user_id not in user_sessions:
+            await callback.answer("Session expired")
+            return await callback.message.edit_text("Session expired", reply_markup=kb_guest())
+        kwargs["session"] = user_sessions[user_id]
+    
+    await action.handler(callback, *args, **kwargs)
+
+
+@callback_action("li")
+async def cb_login(callback: CallbackQuery, state: FSMContext):
+    await callback.message.edit_text(
+        "<b>Authorization</b>\n\nSelect server:",
+        parse_mode="HTML",
+        reply_markup=kb_servers()
+    )
+    await state.set_state(AuthStates.waiting_server)
+
+
+@callback_action("s", str)
+async def cb_server(callback: CallbackQuery, server_id: str, state: FSMContext):
+    await state.update_data(server_id=server_id)
+    await callback.message.edit_text(
+        f"<b>Authorization</b>\n\nServer: <code>{server_id}</code>\n\nEnter login:",
+        parse_mode="HTML"
+    )
+    await state.set_state(AuthStates.waiting_login)
+
+
+@callback_action("c")
+async def cb_cancel(callback: CallbackQuery, state: FSMContext):
+    await state.clear()
+    await callback.message.edit_text("Cancelled", reply_markup=kb_guest())
+
+
+@callback_action("m")
+async def cb_menu(callback: CallbackQuery, session: UserSession):
+    stop_auto_refresh(callback.from_user.id)
+    await callback.message.edit_text(menu_text(session), parse_mode="HTML", reply_markup=kb_main())
+
+
+@callback_action("n")
+async def cb_noop(callback: CallbackQuery):
+    await callback.answer()
+
+
+@callback_action("st")
+async def cb_settings(callback: CallbackQuery, session: UserSession):
+    stop_auto_refresh(callback.from_user.id)
+    await callback.message.edit_text(settings_text(session), parse_mode="HTML", reply_markup=kb_settings(session))
+
+
+@callback_action("ut", str)
+async def cb_untrack(callback: CallbackQuery, login: str, session: UserSession):
+    if login in session.watchlist:
+        session.watchlist.remove(login)
+        save_sessions()
+    
+    await callback.answer(f"Untracked {login}")
+    await callback.message.edit_text(settings_text(session), parse_mode="HTML", reply_markup=kb_settings(session))
+
+
+@callback_action("rl")
+async def cb_rules(callback: CallbackQuery, session: UserSession):
+    await callback.message.edit_text(rules_text(session), parse_mode="HTML", reply_markup=kb_rules(session))
+
+
+@callback_action("rd", int)
+async def cb_rule_delete(callback: CallbackQuery, index: int, session: UserSession):
+    user_id = callback.from_user.id
+    if index >= len(session.rules):
+        return await callback.answer()
+    
+    unindex_rules(user_id)
+    rule = session.rules.pop(index)
+    index_rules(user_id)
+    save_sessions()
+    
+    await callback.answer(f"Deleted: {describe_rule(rule)}")
+    await callback.message.edit_text(rules_text(session), parse_mode="HTML", reply_markup=kb_rules(session))
+
+
+@callback_action("tn")
+async def cb_toggle_notif(callback: CallbackQuery, session: UserSession):
+    session.notifications = not session.notifications
+    save_sessions()
+    if session.notifications and callback.from_user.id in monitor_tasks:
+        ensure_server_poller(session.server_id)
+    
+    await callback.answer(f"Notifications {'ON' if session.notifications else 'OFF'}")
+    await callback.message.edit_reply_markup(reply_markup=kb_settings(session))
+
+
+@callback_action("tg")
+async def cb_toggle_global_auto(callback: CallbackQuery, session: UserSession):
+    session.auto_refresh = not session.auto_refresh
+    save_sessions()
+    
+    await callback.answer(f"Auto-refresh {'ON' if session.auto_refresh else 'OFF'}")
+    await callback.message.edit_reply_markup(reply_markup=kb_settings(session))
+
+
+@callback_action("td")
+async def cb_toggle_digest(callback: CallbackQuery, session: UserSession):
+    session.digest = not session.digest
+    save_sessions()
+    
+    await callback.answer(f"Daily digest {'ON' if session.digest else 'OFF'} (sent at {DIGEST_TIME})")
+    await callback.message.edit_reply_markup(reply_markup=kb_settings(session))
+
+
+@callback_action("lo")
+async def cb_logout(callback: CallbackQuery):
+    user_id = callback.from_user.id
+    stop_monitor(user_id)
+    stop_auto_refresh(user_id)
+    stop_user_dashboards(user_id)
+    if user_id in user_sessions:
+        del user_sessions[user_id]
+        save_sessions()
+    
+    await callback.message.edit_text("Logged out", reply_markup=kb_guest())
+
+
+# ===========================================================
+#                    VIEW HANDLERS
+# ===========================================================
+
+def callback_live(callback: CallbackQuery, view_code: str, page: int, level_filter: int, admin_login: str):
+    view_type = VIEW_CODES.get(view_code)
+    if view_type is None:
+        return None
+    return LiveMessage(
+        callback.message.chat.id, callback.message.message_id, view_type, page, level_filter, admin_login
+    )
+
+
+async def show_view(callback: CallbackQuery, session: UserSession, live: LiveMessage) -> bool:
+    user_id = callback.from_user.id
+    try:
+        shown = await show_latest(callback, prefetched_view(user_id, session, live))
+        if shown:
+            start_prefetch(user_id, live)
+        return shown
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            await callback.answer("Error")
+    except Exception as e:
+        await callback.answer(f"Error: {e}", show_alert=True)
+    return False
+
+
+@callback_action("v", str, int, int, str)
+async def cb_view(
+    callback: CallbackQuery, view_code: str, page: int, level_filter: int, admin_login: str,
+    session: UserSession
+):
+    live = callback_live(callback, view_code, page, level_filter, admin_login)
+    if live is None:
+        return await callback.answer()
+    
+    await callback.answer("Loading...")
+    if await show_view(callback, session, live):
+        live_messages[callback.from_user.id] = live
+        start_auto_refresh(callback.from_user.id)
+
+
+@callback_action("r", str, int, int, str)
+async def cb_refresh(
+    callback: CallbackQuery, view_code: str, page: int, level_filter: int, admin_login: str,
+    session: UserSession
+):
+    live = callback_live(callback, view_code, page, level_filter, admin_login)
+    if live is None:
+        return await callback.answer()
+    
+    await callback.answer("Refreshing...")
+    if await show_view(callback, session, live):
+        live_messages[callback.from_user.id] = live
+
+
+@callback_action("ta", str, int, int, str)
+async def cb_toggle_auto(
+    callback: CallbackQuery, view_code: str, page: int, level_filter: int, admin_login: str,
+    session: UserSession
+):
+    user_id = callback.from_user.id
+    live = callback_live(callback, view_code, page, level_filter, admin_login)
+    if live is None:
+        return await callback.answer()
+    
+    session.auto_refresh = not session.auto_refresh
+    save_sessions()
+    
+    if session.auto_refresh:
+        await callback.answer("Auto-refresh ON")
+    else:
+        stop_auto_refresh(user_id)
+        await callback.answer("Auto-refresh OFF")
+    
+    if await show_view(callback, session, live) and session.auto_refresh:
+        live_messages[user_id] = live
+        start_auto_refresh(user_id)
+
+
+@callback_action("t", str)
+async def cb_track_admin(callback: CallbackQuery, admin_login: str, session: UserSession):
+    if admin_login in session.watchlist:
+        session.watchlist.remove(admin_login)
+        await callback.answer(f"Untracked {admin_login}")
+    else:
+        session.watchlist.append(admin_login)
+        await callback.answer(f"Now tracking {admin_login}")
+    save_sessions()
+    
+    is_tracked = admin_login in session.watchlist
+    kb = kb_admin_profile(admin_login, is_tracked, session.auto_refresh)
+    await callback.message.edit_reply_markup(reply_markup=kb)
+
+
+# ===========================================================
+#                    AUTHORIZATION
+# ===========================================================
+
+@router.message(AuthStates.waiting_login)
+async def process_login(message: Message, state: FSMContext):
+    await state.update_data(login=message.text)
+    await message.answer("Enter password:")
+    await state.set_state(AuthStates.waiting_password)
+
+
+@router.message(AuthStates.waiting_password)
+async def process_password(message: Message, state: FSMContext):
+    await state.update_data(password=message.text)
+    try:
+        await message.delete()
+    except:
+        pass
+    await message.answer("Enter 2FA code:")
+    await state.set_state(AuthStates.waiting_2fa)
+
+
+@router.message(AuthStates.waiting_2fa)
+async def process_2fa(message: Message, state: FSMContext):
+    data = await state.get_data()
+    await state.clear()
+    
+    status_msg = await message.answer("Authorizing...")
+    
+    auth_data = {
+        "login": data["login"],
+        "password": data["password"],
+        "serverId": data["server_id"],
+        "code": message.text
+    }
+    
+    async with aiohttp.ClientSession() as http_session:
+        try:
+            async with http_session.post(f"{BASE_URL}/auth/login", json=auth_data) as resp:
+                login_resp = await resp.json()
+            
+            if login_resp.get("status") and login_resp.get("result", {}).get("sessionId"):
+                result = login_resp["result"]
+                session_id = result["sessionId"]
+                server_id = result["serverId"]
+                
+                cookies = {"sessionId": session_id, "serverId": server_id}
+                async with http_session.get(f"{BASE_URL}/admin/users/me", cookies=cookies) as me_resp:
+                    me_data = await me_resp.json()
+                
+                user_info = me_data.get("result", {})
+                
+                user_sessions[message.from_user.id] = UserSession(
+                    session_id=session_id,
+                    server_id=server_id,
+                    login=result["account"]["login"],
+                    admin_level=user_info.get("adminLevel", 0),
+                    rights=user_info.get("rights", [])
+                )
+                
+                save_sessions()
+                start_monitor(message.from_user.id)
+                
+                await status_msg.edit_text(
+                    f"<b>Authorization successful!</b>\n\n"
+                    f"Account: <b>{result['account']['login']}</b>\n"
+                    f"Server: <code>{server_id}</code>\n"
+                    f"{get_level_name(user_info.get('adminLevel', 0))}\n"
+                    f"Rights: {len(user_info.get('rights', []))}\n\n"
+                    f"Notifications: ON\n"
+                    f"Auto-refresh: ON",
+                    parse_mode="HTML",
+                    reply_markup=kb_main()
+                )
+            else:
+                error = login_resp.get("result", "Unknown error")
+                await status_msg.edit_text(
+                    f"<b>Authorization failed</b>\n\n{error}",
+                    parse_mode="HTML",
+                    reply_markup=kb_guest()
+                )
+        except Exception as e:
+            await status_msg.edit_text(
+                f"<b>Error</b>\n\n{e}",
+                parse_mode="HTML",
+                reply_markup=kb_guest()
+            )
+
+
+# ===========================================================
+#                       MIDDLEWARES
+# ===========================================================
+
+@dp.update.outer_middleware()
+async def track_activity(handler, event, data):
+    user = data.get("event_from_user")
+    if user:
+        touch_user(user.id)
+    return await handler(event, data)
+
+
+def supersede_render(update: Update, user_id: int):
+    """A new click on a message cancels the render still running for it"""
+    callback = update.callback_query
+    if callback is None or callback.message is None or callback.data == encode_callback("n"):
+        return
+    job = view_jobs.get((user_id, callback.message.message_id))
+    if job is not None:
+        job.cancel()
+
+
+@dp.update.outer_middleware()
+async def serialize_per_user(handler, event, data):
+    """
+    Updates run concurrently across users but one at a time per user, so
+    handlers never interleave on the same user's session, live view or FSM
+    state. The per-user lock is dropped once nothing is queued behind it.
+    """
+    global inflight_updates
+    user = data.get("event_from_user")
+    if user is None:
+        return await handler(event, data)
+    
+    user_id = user.id
+    supersede_render(event, user_id)
+    update_depth[user_id] = update_depth.get(user_id, 0) + 1
+    update_depth_samples.append(update_depth[user_id])
+    lock = update_locks.setdefault(user_id, asyncio.Lock())
+    try:
+        async with lock:
+            inflight_updates += 1
+            try:
+                return await handler(event, data)
+            finally:
+                inflight_updates -= 1
+    finally:
+        update_depth[user_id] -= 1
+        if not update_depth[user_id]:
+            del update_depth[user_id]
+            update_locks.pop(user_id, None)
+
+
+@dp.update.outer_middleware()
+async def track_first_update(handler, event, data):
+    global first_update_at
+    result = await handler(event, data)
+    if first_update_at is None:
+        first_update_at = time.monotonic()
+        print(f"First update handled {first_update_at - started_at:.2f}s after start")
+    return result
+
+
+# ===========================================================
+#                        HTTP API
+# ===========================================================
+
+def snapshot_events(previous: Optional[ServerSnapshot], snapshot: ServerSnapshot) -> list[dict]:
+    """Server-wide changes between two snapshots, as monitor_loop detects them per user"""
+    if previous is None:
+        return []
+    base = {"server_id": snapshot.server_id, "at": snapshot.fetched_at}
+    events = []
+    
+    old_online = {a["login"] for a in previous.admins if a.get("online", 0) > 0}
+    new_online = {a["login"]: a.get("admin", 0) for a in snapshot.admins if a.get("online", 0) > 0}
+    for login in sorted(new_online.keys() - old_online):
+        events.append({**base, "type": "joined", "login": login, "level": new_online[login]})
+    for login in sorted(old_online - new_online.keys()):
+        events.append({**base, "type": "left", "login": login})
+    
+    for key in STAT_NAMES:
+        old, new = previous.stats.get(key, 0), snapshot.stats.get(key, 0)
+        if old != new:
+            events.append({**base, "type": "stats", "key": key, "old": old, "new": new})
+    
+    old_reports = {a["login"]: admin_report_count(a) for a in previous.admins}
+    for admin in snapshot.admins:
+        old, new = old_reports.get(admin["login"], 0), admin_report_count(admin)
+        if old != new:
+            events.append({**base, "type": "reports", "login": admin["login"], "old": old, "new": new})
+    return events
+
+
+def publish_events(events: list[dict]):
+    for queue in event_streams:
+        for event in events:
+            if queue.full():
+                # Slow consumer: keep the newest events
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+
+def snapshot_json(snapshot: ServerSnapshot) -> dict:
+    return {
+        "server_id": snapshot.server_id,
+        "fetched_at": snapshot.fetched_at,
+        "stats": snapshot.stats,
+        "admins": snapshot.admins,
+    }
+
+
+@web.middleware
+async def api_auth(request: web.Request, handler):
+    # Header only: a token in the query string would end up in access logs
+    auth = request.headers.get("Authorization", "")
+    if not API_TOKEN or not auth.startswith("Bearer ") or not hmac.compare_digest(auth[7:].encode(), API_TOKEN.encode()):
+        raise web.HTTPUnauthorized()
+    return await handler(request)
+
+
+async def api_servers(request: web.Request) -> web.Response:
+    snapshots = dict(server_snapshots)
+    if shard_db is not None:
+        # Servers polled by other shards
+        for snapshot in await shard_call(load_shared_snapshots):
+            current = snapshots.get(snapshot.server_id)
+            if current is None or current.fetched_at < snapshot.fetched_at:
+                snapshots[snapshot.server_id] = snapshot
+    
+    servers = [
+        {
+            "server_id": snapshot.server_id,
+            "fetched_at": snapshot.fetched_at,
+            "stats": snapshot.stats,
+            "online": sum(1 for a in snapshot.admins if a.get("online", 0) > 0),
+            "admins": len(snapshot.admins),
+        }
+        for snapshot in snapshots.values()
+    ]
+    return web.json_response({"servers": servers})
+
+
+async def api_snapshot(request: web.Request) -> web.Response:
+    server_id = request.match_info["server_id"]
+    snapshot = server_snapshots.get(server_id)
+    if snapshot is None and shard_db is not None:
+        snapshot = await shard_call(load_shared_snapshot, server_id, 0.0)
+    if snapshot is None:
+        raise web.HTTPNotFound()
+    return web.json_response(snapshot_json(snapshot))
+
+
+async def api_events(request: web.Request) -> web.StreamResponse:
+    """Server-Sent Events stream of snapshot changes, optionally for one ?server="""
+    server_id = request.query.get("server")
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+    
+    queue = asyncio.Queue(EVENT_STREAM_BUFFER)
+    event_streams.add(queue)
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE)
+            except TimeoutError:
+                await response.write(b": keepalive\n\n")
+                continue
+            if event is None:
+                break
+            if server_id and event["server_id"] != server_id:
+                continue
+            await response.write(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode())
+    except ConnectionResetError:
+        pass
+    finally:
+        event_streams.discard(queue)
+    return response
+
+
+async def shared_events_loop():
+    """In sharded mode, stream changes of the servers other shards follow"""
+    seen: dict[str, ServerSnapshot] = {}
+    while True:
+        heartbeat()
+        await asyncio.sleep(SHARED_SNAPSHOT_POLL)
+        if not event_streams:
+            seen.clear()
+            continue
+        
+        for snapshot in await shard_call(load_shared_snapshots):
+            previous = seen.get(snapshot.server_id)
+            if previous is not None and previous.fetched_at >= snapshot.fetched_at:
+                continue
+            seen[snapshot.server_id] = snapshot
+            # Servers this shard polls itself are published by store_snapshot
+            if snapshot.server_id not in server_pollers:
+                publish_events(snapshot_events(previous, snapshot))
+
+
+def start_shared_events():
+    supervise("api-events", shared_events_loop(), start_shared_events, SHARED_SNAPSHOT_POLL)
+
+
+async def start_api():
+    global api_runner
+    if not API_PORT:
+        return
+    if not API_TOKEN:
+        # Still bind: the platform restarts a web process that never listens
+        print("  ! API_TOKEN is not set, HTTP API requests are refused")
+    
+    app = web.Application(middlewares=[api_auth])
+    app.add_routes([
+        web.get("/api/servers", api_servers),
+        web.get("/api/servers/{server_id}", api_snapshot),
+        web.get("/api/events", api_events),
+    ])
+    api_runner = web.AppRunner(app)
+    await api_runner.setup()
+    await web.TCPSite(api_runner, API_HOST, API_PORT).start()
+    print(f"HTTP API listening on {API_HOST}:{API_PORT}")
+    if shard_db is not None:
+        start_shared_events()
+
+
+async def stop_api():
+    for queue in event_streams:
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(None)
+    if api_runner is not None:
+        await api_runner.cleanup()
+
+
+# ===========================================================
+#                         STARTUP
+# ===========================================================
+
+async def set_commands():
+    commands = [
+        BotCommand(command="start", description="Main menu"),
+        BotCommand(command="menu", description="Open menu"),
+        BotCommand(command="rules", description="Alert rules"),
+        BotCommand(command="rule", description="Add alert rule"),
+        BotCommand(command="digest", description="Today's digest so far"),
+        BotCommand(command="status", description="Server status and alerts"),
+        BotCommand(command="log", description="Recent events"),
+        BotCommand(command="who", description="Who was online at a time"),
+        BotCommand(command="dashboard", description="Post a live dashboard"),
+    ]
+    await bot.set_my_commands(commands)
+
+
+async def warm_start(register_commands: bool = True):
+    """Deferred startup work, run while updates are already being served"""
+    start_supervisor()
+    await restore_sessions()
+    start_hibernation()
+    start_digest()
+    start_servers_poller()
+    start_governor()
+    start_log()
+    
+    if register_commands:
+        try:
+            await set_commands()
+        except Exception as e:
+            print(f"  ! Command registration failed: {e}")
+    
+    print(f"Warm start finished in {time.monotonic() - started_at:.2f}s")
+
+
+async def shutdown():
+    print("\nShutting down...")
+    
+    save_sessions()
+    print("  - Sessions saved")
+    
+    flush_log()
+    print("  - Notification log flushed")
+    
+    for user_id in list(monitor_tasks.keys()):
+        stop_monitor(user_id)
+    print("  - Monitoring stopped")
+    
+    for user_id in list(refresh_tasks.keys()):
+        stop_auto_refresh(user_id)
+    print("  - Auto-refresh stopped")
+    
+    for key in list(dashboards):
+        stop_dashboard(key)
+    print("  - Dashboards stopped")
+    
+    for task in list(server_pollers.values()):
+        task.cancel()
+    print("  - Server pollers stopped")
+    
+    await stop_api()
+    print("  - HTTP API stopped")
+    
+    await bot.session.close()
+    print("  - Bot session closed")
+    
+    print("Bot stopped!")
+
+
+async def main():
+    dp.include_router(router)
+    await start_api()
+    spawn_background(warm_start())
+    
+    print("=" * 30)
+    print("  MAJESTIC MONITOR")
+    print("=" * 30)
+    print("Bot started!")
+    print("Press Ctrl+C to stop\n")
+    
+    try:
+        await dp.start_polling(bot, tasks_concurrency_limit=MAX_INFLIGHT_UPDATES)
+    finally:
+        await shutdown()
+
+
+# ===========================================================
+#                      SHARDED MODE
+# ===========================================================
+
+def update_user_id(update: Update) -> int:
+    user = getattr(update.event, "from_user", None)
+    return user.id if user else 0
+
+
+async def run_gateway(queues: list):
+    """Poll Telegram once and route every update to the shard owning its user"""
+    spawn_background(set_commands())
+    
+    print("=" * 30)
+    print("  MAJESTIC MONITOR")
+    print("=" * 30)
+    print(f"Gateway started with {len(queues)} shards")
+    print("Press Ctrl+C to stop\n")
+    
+    offset = None
+    try:
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30)
+            except Exception:
+                await asyncio.sleep(1)
+                continue
+            
+            for update in updates:
+                offset = update.update_id + 1
+                shard = update_user_id(update) % len(queues)
+                queues[shard].put(update.model_dump_json(by_alias=True, exclude_none=True))
+    finally:
+        await bot.session.close()
+
+
+async def worker_main(index: int, queue):
+    global shard_id, shard_db
+    shard_id = index
+    shard_db = open_shard_db()
+    dp.include_router(router)
+    if index == 0:
+        # Serves shard 0's snapshots, and other servers' from the shared table
+        await start_api()
+    spawn_background(warm_start(register_commands=False))
+    
+    print(f"Shard {index} started")
+    
+    loop = asyncio.get_running_loop()
+    handlers = set()
+    slots = asyncio.Semaphore(MAX_INFLIGHT_UPDATES)
+    
+    def finished(task: asyncio.Task):
+        handlers.discard(task)
+        slots.release()
+    
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, queue.get)
+            if raw is None:
+                break
+            await slots.acquire()
+            task = asyncio.create_task(dp.feed_raw_update(bot, json.loads(raw)))
+            handlers.add(task)
+            task.add_done_callback(finished)
+    finally:
+        await shutdown()
+        shard_db.close()
+
+
+def run_worker(index: int, queue):
+    try:
+        asyncio.run(worker_main(index, queue))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_sharded():
+    ctx = multiprocessing.get_context("spawn")
+    queues = [ctx.Queue() for _ in range(SHARD_COUNT)]
+    workers = [ctx.Process(target=run_worker, args=(i, q)) for i, q in enumerate(queues)]
+    for worker in workers:
+        worker.start()
+    
+    try:
+        asyncio.run(run_gateway(queues))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for worker in workers:
+            worker.join(10)
+
+
+if __name__ == "__main__":
+    if SHARD_COUNT > 1:
+        run_sharded()
+    else:
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            pass